@@ -0,0 +1,292 @@
+# Offline benchmark for the playlist script. It starts the mock server from
+# mock_plex_server.py, points the script at it and times the pieces that
+# talk to Plex, plus a full run of main(), for playlists of a few sizes.
+#
+#   python benchmarks/bench_pipeline.py --sizes 10,100,1000 --latency-ms 5
+#
+# For every scenario it prints songs per second, HTTP requests per song and
+# the p50/p95 latency of one call (one song, or one batch for the playlist
+# adds; for main() the lookup of one song). Songs are about half from the library, 40% only on the provider (a
+# quarter of those with a descriptor that has to be dropped to find them) and
+# 10% nowhere. Caches and the journal are off so every run starts cold.
+
+import argparse
+import builtins
+import contextlib
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from mock_plex_server import MockPlexServer, TRACKS_PER_ALBUM, TRACKS_PER_ARTIST
+
+SCRIPT = os.path.join(REPO_DIR, 'plex-playlist-chatgpt-prompt-user.py')
+
+
+def load_script(url: str):
+    spec = importlib.util.spec_from_file_location('ppg_bench_target', SCRIPT)
+    ppg = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(ppg)
+    ppg.PLEX_URL = url
+    ppg.PROVIDER_URL = url
+    ppg.PLEX_TOKEN = 'mock-token'
+    ppg.SECTION_TITLE = 'Music'
+    ppg.ADMIN_NAME = 'admin'
+    ppg.LIBRARY_CACHE_FILE = None
+    ppg.LIBRARY_INDEX_FILE = None
+    ppg.SEARCH_CACHE_FILE = None
+    ppg.JOURNAL_DIR = None
+    ppg.HTTP_RATE_LIMIT = 1_000_000  # The mock has no rate limit to respect
+    ppg.HTTP_RATE_BURST = 1_000_000
+    return ppg
+
+
+def synthetic_playlist(size: int, library_size: int) -> list:
+    songs = []
+    for i in range(size):
+        kind = i % 10
+        if kind < 5:
+            # A library song; skip the live albums, those only match on the provider
+            track = (i * 7919) % library_size
+            if (track // TRACKS_PER_ALBUM) % 10 == 9:
+                track -= TRACKS_PER_ALBUM
+            songs.append(f"Artist {track // TRACKS_PER_ARTIST} - Song {track}")
+        elif kind < 8:
+            number = i if i % 5 else i + 1
+            songs.append(f"Visiting Band {number} - Tune {number}")
+        elif kind < 9:
+            # Only found once the descriptor is dropped from the search
+            number = i if i % 5 else i + 1
+            songs.append(f"Visiting Band {number} - Tune {number} (Remastered)")
+        else:
+            number = i - i % 5
+            songs.append(f"Visiting Band {number} - Tune {number}")
+    return songs
+
+
+def percentile(values: list, fraction: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def report(rows: list, name: str, songs: int, elapsed: float, requests: int, latencies: list):
+    p50, p95 = percentile(latencies, 0.50), percentile(latencies, 0.95)
+    rows.append((name, songs, songs / elapsed if elapsed else 0.0, requests / songs if songs else 0.0,
+                 p50 and p50 * 1000, p95 and p95 * 1000))
+    print(f"  {name:<28} {songs:>6} songs {elapsed:8.2f}s", file=sys.stderr)
+
+
+def split_song(song: str) -> tuple:
+    artist, title = song.split(' - ', 1)
+    return artist, title
+
+
+def bench_find_track(ppg, mock: MockPlexServer, rows: list, songs: list, legacy_max: int):
+    plex = ppg.PlexServer(ppg.PLEX_URL, ppg.PLEX_TOKEN, session=ppg.http_session)
+    section = ppg.get_music_library(plex, ppg.SECTION_TITLE)
+
+    mock.reset_counts()
+    start = time.perf_counter()
+    index = ppg.build_library_index(section)
+    latencies = []
+    for song in songs:
+        _, elapsed = timed(ppg.find_track_in_library, index, *split_song(song))
+        latencies.append(elapsed)
+    report(rows, 'find_track_in_library index', len(songs), time.perf_counter() - start, mock.total_requests(), latencies)
+
+    if len(songs) <= legacy_max:
+        mock.reset_counts()
+        start = time.perf_counter()
+        latencies = []
+        for song in songs:
+            _, elapsed = timed(ppg.find_track_in_library, section, *split_song(song))
+            latencies.append(elapsed)
+        report(rows, 'find_track_in_library server', len(songs), time.perf_counter() - start, mock.total_requests(), latencies)
+
+
+def bench_search_tidal(ppg, mock: MockPlexServer, rows: list, songs: list):
+    # Same fan-out as resolve_songs, so songs/sec is what a real run would see
+    def search(song):
+        return timed(ppg.search_tidal, ppg.PLEX_TOKEN, *split_song(song))
+
+    mock.reset_counts()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=ppg.RESOLVE_WORKERS) as executor:
+        results = list(executor.map(search, songs))
+    report(rows, 'search_tidal', len(songs), time.perf_counter() - start, mock.total_requests(), [elapsed for _, elapsed in results])
+
+
+def bench_add_tracks(ppg, mock: MockPlexServer, rows: list, size: int):
+    tidal_ids = [f"5e{number:08x}" for number in range(size)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        playlist_ratingKey, _ = ppg.create_playlist(ppg.PLEX_URL, ppg.PLEX_TOKEN, f"bench add {size}", ppg.PROVIDER_URI, tidal_ids[:1])
+        remaining = tidal_ids[1:]
+
+        # Time each batch request on its own by wrapping the single-batch PUT
+        latencies = []
+        put_playlist_items = ppg.put_playlist_items
+
+        def timed_put(*args):
+            ok, elapsed = timed(put_playlist_items, *args)
+            latencies.append(elapsed)
+            return ok
+
+        ppg.put_playlist_items = timed_put
+        mock.reset_counts()
+        start = time.perf_counter()
+        try:
+            ppg.add_track_to_playlist(ppg.PLEX_URL, ppg.PLEX_TOKEN, remaining, playlist_ratingKey)
+        finally:
+            ppg.put_playlist_items = put_playlist_items
+    report(rows, 'add_track_to_playlist', len(remaining), time.perf_counter() - start, mock.total_requests(), latencies)
+
+
+def bench_main(ppg, mock: MockPlexServer, rows: list, songs: list, workdir: str):
+    filename = os.path.join(workdir, f"playlist-{len(songs)}.txt")
+    with open(filename, 'w') as file:
+        file.write('\n'.join(songs) + '\n')
+    answers = iter(['admin', filename, f"bench main {len(songs)} {time.time()}"])
+
+    # Time each song's lookup inside the run by wrapping resolve_song
+    latencies = []
+    resolve_song = ppg.resolve_song
+
+    def timed_resolve(*args):
+        result, elapsed = timed(resolve_song, *args)
+        latencies.append(elapsed)
+        return result
+
+    original_input = builtins.input
+    builtins.input = lambda prompt='': next(answers)
+    ppg.resolve_song = timed_resolve
+    mock.reset_counts()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            ppg.main()
+    finally:
+        builtins.input = original_input
+        ppg.resolve_song = resolve_song
+    report(rows, 'main()', len(songs), time.perf_counter() - start, mock.total_requests(), latencies)
+
+
+def bench_index_storage(ppg, mock: MockPlexServer, songs: list, workdir: str):
+    # Object index built from a warm SQLite cache (the old startup path)
+    # against the compact index file, cold (written) and warm (just mapped).
+    # Heap is what the index keeps in Python memory once loaded; the compact
+    # index's file is mapped, so its pages are shared page cache instead.
+    plex = ppg.PlexServer(ppg.PLEX_URL, ppg.PLEX_TOKEN, session=ppg.http_session)
+    section = ppg.get_music_library(plex, ppg.SECTION_TITLE)
+    ppg.LIBRARY_CACHE_FILE = os.path.join(workdir, 'library.sqlite')
+    index_file = os.path.join(workdir, 'library.idx')
+    results = []
+
+    def load():
+        # Ready to answer lookups, including the blocking index that the
+        # object index otherwise builds on its first lookup
+        with contextlib.redirect_stdout(io.StringIO()):
+            index = ppg.build_library_index(section)
+        index.columns()
+        index.blocking_index()
+        return index
+
+    def measure(name: str, file_name, prepare=None):
+        ppg.LIBRARY_INDEX_FILE = file_name
+        if prepare:
+            prepare()
+        mock.reset_counts()
+        index, elapsed = timed(load)
+        requests = mock.total_requests()
+        start = time.perf_counter()
+        for song in songs:
+            ppg.find_track_in_library(index, *split_song(song))
+        lookups = len(songs) / (time.perf_counter() - start)
+        del index
+
+        if prepare:
+            prepare()
+        tracemalloc.start()
+        index = load()
+        heap = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        file_size = os.path.getsize(file_name) if file_name else 0
+        tracks = len(index)  # indexed tracks, after the live/date exclusions
+        results.append((name, elapsed * 1000, requests, heap / tracks, file_size / tracks, lookups))
+        print(f"  {name:<28} {elapsed:8.2f}s", file=sys.stderr)
+
+    def remove_index_file():
+        if os.path.exists(index_file):
+            os.remove(index_file)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        ppg.build_library_index(section)  # warm the SQLite cache
+    measure('object index (sqlite)', None)
+    measure('compact index (rebuild)', index_file, remove_index_file)
+    measure('compact index (mapped)', index_file)
+    ppg.LIBRARY_CACHE_FILE = None
+    ppg.LIBRARY_INDEX_FILE = None
+
+    print(f"{'index storage':<30}{'load ms':>9}{'requests':>10}{'heap B/track':>14}{'file B/track':>14}{'lookups/s':>11}")
+    for name, load_ms, requests, heap, file_size, lookups in results:
+        print(f"{name:<30}{load_ms:>9.1f}{requests:>10}{heap:>14.0f}{file_size:>14.0f}{lookups:>11.0f}")
+    print()
+
+
+def print_table(rows: list):
+    print(f"{'scenario':<30}{'songs':>7}{'songs/s':>11}{'req/song':>10}{'p50 ms':>9}{'p95 ms':>9}")
+    for name, songs, rate, requests, p50, p95 in rows:
+        # '-' where a scenario has no per-call latencies to report
+        p50, p95 = ('-' if value is None else f"{value:.2f}" for value in (p50, p95))
+        print(f"{name:<30}{songs:>7}{rate:>11.1f}{requests:>10.2f}{p50:>9}{p95:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the playlist script against a local mock Plex server.")
+    parser.add_argument('--sizes', default='10,100,1000,5000', help="comma separated playlist sizes (default: 10,100,1000,5000)")
+    parser.add_argument('--library-size', type=int, default=20000, help="tracks in the mock library (default: 20000)")
+    parser.add_argument('--latency-ms', type=float, default=5.0, help="delay the mock adds to every response (default: 5)")
+    parser.add_argument('--legacy-max', type=int, default=100, help="largest playlist to also run through the old per-artist server lookups (default: 100)")
+    parser.add_argument('--scenarios', default='find,search,add,main,index', help="which of find,search,add,main,index to run")
+    args = parser.parse_args()
+
+    scenarios = set(args.scenarios.split(','))
+    mock = MockPlexServer(library_size=args.library_size, latency=args.latency_ms / 1000)
+    url = mock.start()
+    ppg = load_script(url)
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            if 'index' in scenarios:
+                print("Library index storage:", file=sys.stderr)
+                bench_index_storage(ppg, mock, synthetic_playlist(1000, args.library_size), workdir)
+            for size in [int(size) for size in args.sizes.split(',')]:
+                print(f"Playlist of {size} songs:", file=sys.stderr)
+                songs = synthetic_playlist(size, args.library_size)
+                if 'find' in scenarios:
+                    bench_find_track(ppg, mock, rows, songs, args.legacy_max)
+                if 'search' in scenarios:
+                    bench_search_tidal(ppg, mock, rows, songs)
+                if 'add' in scenarios:
+                    bench_add_tracks(ppg, mock, rows, size)
+                if 'main' in scenarios:
+                    bench_main(ppg, mock, rows, songs, workdir)
+    finally:
+        mock.stop()
+    print_table(rows)
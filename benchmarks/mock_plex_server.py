@@ -0,0 +1,266 @@
+# A stand-in for a Plex Media Server and the Plex music provider, for running
+# the benchmarks offline. It serves canned XML for a synthetic music library:
+#
+#   track t  -> "Artist {t // 50} - Song {t}" on "Album {t // 10}"
+#               (every 10th album is a live album, so the exclusions get used)
+#
+# and a provider catalogue holding every library song plus "Tune N" songs by
+# "Visiting Band N", except where N is a multiple of 5, which are missing.
+# Every response waits `latency` seconds first, and every request is counted
+# per endpoint so the benchmark can report requests per song.
+
+import threading
+import time
+import re
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from xml.sax.saxutils import quoteattr
+
+TRACKS_PER_ALBUM = 10
+ALBUMS_PER_ARTIST = 5
+TRACKS_PER_ARTIST = TRACKS_PER_ALBUM * ALBUMS_PER_ARTIST
+ALBUM_KEY_OFFSET = 1_000_000
+ARTIST_KEY_OFFSET = 2_000_000
+UPDATED_AT_BASE = 1_700_000_000
+SECTION_KEY = 1
+MACHINE_IDENTIFIER = 'mock-plex-server'
+
+
+def attrs(**values) -> str:
+    return ' '.join(f"{key}={quoteattr(str(value))}" for key, value in values.items())
+
+
+def container(children: list, **values) -> bytes:
+    return f"<MediaContainer {attrs(**values)}>{''.join(children)}</MediaContainer>".encode('utf-8')
+
+
+class MockPlexServer:
+    def __init__(self, library_size: int = 10000, latency: float = 0.0, section_title: str = 'Music'):
+        self.library_size = library_size
+        self.latency = latency
+        self.section_title = section_title
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        self.playlists = {}  # ratingKey -> {'title', 'owner', 'items': [(playlistItemID, uri scheme, id)]}
+        self.next_item_id = 1
+        self.httpd = None
+
+    # ---- synthetic library ----
+
+    def artist_title(self, artist: int) -> str:
+        return f"Artist {artist}"
+
+    def album_title(self, album: int) -> str:
+        return f"Live at Venue {album}" if album % 10 == 9 else f"Album {album}"
+
+    def track_xml(self, track: int) -> str:
+        album = track // TRACKS_PER_ALBUM
+        artist = track // TRACKS_PER_ARTIST
+        return f"<Track {attrs(ratingKey=track + 1, key=f'/library/metadata/{track + 1}', type='track', title=f'Song {track}', grandparentTitle=self.artist_title(artist), parentTitle=self.album_title(album), parentRatingKey=album + ALBUM_KEY_OFFSET, grandparentRatingKey=artist + ARTIST_KEY_OFFSET, librarySectionID=SECTION_KEY, addedAt=UPDATED_AT_BASE + track, updatedAt=UPDATED_AT_BASE + track)}/>"
+
+    def album_xml(self, album: int) -> str:
+        artist = album // ALBUMS_PER_ARTIST
+        return f"<Directory {attrs(ratingKey=album + ALBUM_KEY_OFFSET, key=f'/library/metadata/{album + ALBUM_KEY_OFFSET}/children', type='album', title=self.album_title(album), parentTitle=self.artist_title(artist), parentRatingKey=artist + ARTIST_KEY_OFFSET, librarySectionID=SECTION_KEY)}/>"
+
+    def artist_xml(self, artist: int) -> str:
+        return f"<Directory {attrs(ratingKey=artist + ARTIST_KEY_OFFSET, key=f'/library/metadata/{artist + ARTIST_KEY_OFFSET}/children', type='artist', title=self.artist_title(artist), librarySectionID=SECTION_KEY)}/>"
+
+    def artist_count(self) -> int:
+        return (self.library_size + TRACKS_PER_ARTIST - 1) // TRACKS_PER_ARTIST
+
+    # ---- provider catalogue ----
+
+    def provider_track_xml(self, artist: str, title: str, guid: str) -> str:
+        return f"<Track {attrs(type='track', title=title, grandparentTitle=artist, parentTitle=f'{title} - Single', guid=f'tidal://track/{guid}')}/>"
+
+    def provider_search(self, query: str) -> bytes:
+        tracks = []
+        # Like the real search, extra words such as a "Remastered" descriptor
+        # keep the right track from turning up
+        match = re.fullmatch(r"(.*) (Song|Tune) (\d+)", query)
+        if match:
+            artist, kind, number = match.group(1), match.group(2), int(match.group(3))
+            # A decoy first, like the karaoke versions the real search returns
+            tracks.append(self.provider_track_xml('Karaoke All Stars', f"{kind} {number} (Karaoke Version)", f"decoy{number:x}"))
+            if (kind == 'Song' and number < self.library_size) or (kind == 'Tune' and number % 5):
+                tracks.append(self.provider_track_xml(artist, f"{kind} {number}", f"5e{number:08x}"))
+        hub = f"<Hub {attrs(type='track', hubIdentifier='track', size=len(tracks))}>{''.join(tracks)}</Hub>"
+        return container([hub], size=1)
+
+    # ---- request handling ----
+
+    def handle(self, method: str, path: str, headers) -> tuple:
+        parts = urlsplit(path)
+        query = {key: values[-1] for key, values in parse_qs(parts.query, keep_blank_values=True).items()}
+        start = int(headers.get('X-Plex-Container-Start') or query.get('X-Plex-Container-Start') or 0)
+        size = int(headers.get('X-Plex-Container-Size') or query.get('X-Plex-Container-Size') or 1_000_000)
+        route = parts.path
+        token = headers.get('X-Plex-Token') or query.get('X-Plex-Token')
+
+        if route == '/':
+            return 'identity', 200, container([], machineIdentifier=MACHINE_IDENTIFIER, friendlyName='Mock Plex', version='1.40.0.0', myPlexUsername='admin')
+        if route == '/library':
+            return 'library', 200, container([], title1='Plex Library')
+        if route == '/library/sections':
+            section = f"<Directory {attrs(key=SECTION_KEY, type='artist', title=self.section_title, agent='tv.plex.agents.music', scanner='Plex Music', uuid='mock-section-uuid', updatedAt=UPDATED_AT_BASE)}/>"
+            return 'sections', 200, container([section], size=1)
+        if route == f'/library/sections/{SECTION_KEY}/collections':
+            return 'collections', 200, container([], size=0, totalSize=0)
+        if route == f'/library/sections/{SECTION_KEY}/all':
+            return self.handle_section_all(query, start, size)
+        match = re.fullmatch(r'/library/metadata/(\d+)/children', route)
+        if match:
+            return self.handle_children(int(match.group(1)))
+        if route == '/hubs/search':
+            return 'hubs/search', 200, self.provider_search(query.get('query', ''))
+        if route == '/playlists' and method == 'POST':
+            return self.handle_create_playlist(query, token)
+        if route == '/playlists':
+            # Like a real server, every token only sees its own playlists
+            items = [f"<Playlist {attrs(ratingKey=key, key=f'/playlists/{key}/items', type='playlist', playlistType='audio', title=playlist['title'], leafCount=len(playlist['items']))}/>"
+                     for key, playlist in self.playlists.items() if playlist['owner'] == token]
+            return 'playlists', 200, container(items, size=len(items))
+        match = re.fullmatch(r'/playlists/(\d+)/items', route)
+        if match:
+            return self.handle_playlist_items(method, int(match.group(1)), query, start, size)
+        match = re.fullmatch(r'/playlists/(\d+)/items/(\d+)(/move)?', route)
+        if match:
+            return self.handle_playlist_item(method, int(match.group(1)), int(match.group(2)), bool(match.group(3)), query)
+        return 'unknown', 404, b''
+
+    def handle_section_all(self, query: dict, start: int, size: int) -> tuple:
+        if query.get('includeMeta'):
+            meta = (
+                "<Meta>"
+                f"<Type {attrs(key=f'/library/sections/{SECTION_KEY}/all?type=9', type='album', title='Albums', active='0')}>"
+                f"<Field {attrs(key='artist.id', title='Artist', type='integer')}/>"
+                "</Type>"
+                f"<Type {attrs(key=f'/library/sections/{SECTION_KEY}/all?type=8', type='artist', title='Artists', active='1')}/>"
+                f"<FieldType type=\"integer\"><Operator {attrs(key='=', title='is')}/></FieldType>"
+                "</Meta>"
+            )
+            return 'section meta', 200, container([meta], size=0)
+
+        library_type = query.get('type')
+        if library_type == '10':
+            first = int(query['updatedAt>>']) - UPDATED_AT_BASE + 1 if 'updatedAt>>' in query else 0
+            first = max(first, 0)
+            total = max(self.library_size - first, 0)
+            tracks = [self.track_xml(track) for track in range(first + start, min(first + start + size, self.library_size))]
+            return 'section tracks', 200, container(tracks, size=len(tracks), totalSize=total, librarySectionID=SECTION_KEY)
+        if library_type == '9' and 'artist.id' in query:
+            artist = int(query['artist.id']) - ARTIST_KEY_OFFSET
+            albums = [self.album_xml(album) for album in range(artist * ALBUMS_PER_ARTIST, (artist + 1) * ALBUMS_PER_ARTIST)
+                      if album * TRACKS_PER_ALBUM < self.library_size]
+            return 'artist albums', 200, container(albums, size=len(albums), totalSize=len(albums), librarySectionID=SECTION_KEY)
+
+        title = query.get('title', '').lower()
+        artists = [self.artist_xml(artist) for artist in range(self.artist_count()) if title in self.artist_title(artist).lower()]
+        artists = artists[start:start + size]
+        return 'artist search', 200, container(artists, size=len(artists), totalSize=len(artists), librarySectionID=SECTION_KEY)
+
+    def handle_children(self, rating_key: int) -> tuple:
+        if rating_key >= ARTIST_KEY_OFFSET:
+            artist = rating_key - ARTIST_KEY_OFFSET
+            albums = [self.album_xml(album) for album in range(artist * ALBUMS_PER_ARTIST, (artist + 1) * ALBUMS_PER_ARTIST)]
+            return 'artist albums', 200, container(albums, size=len(albums), librarySectionID=SECTION_KEY)
+        album = rating_key - ALBUM_KEY_OFFSET
+        tracks = [self.track_xml(track) for track in range(album * TRACKS_PER_ALBUM, min((album + 1) * TRACKS_PER_ALBUM, self.library_size))]
+        return 'album tracks', 200, container(tracks, size=len(tracks), librarySectionID=SECTION_KEY)
+
+    def handle_create_playlist(self, query: dict, token: str) -> tuple:
+        with self.lock:
+            rating_key = 900_000 + len(self.playlists)
+            self.playlists[rating_key] = {'title': query.get('title', ''), 'owner': token, 'items': []}
+            self.playlists[rating_key]['items'].extend(self.uri_items(query.get('uri', '')))
+        playlist = f"<Playlist {attrs(ratingKey=rating_key, key=f'/playlists/{rating_key}/items', type='playlist', playlistType='audio', title=query.get('title', ''))}/>"
+        return 'create playlist', 200, container([playlist], size=1)
+
+    def uri_items(self, uri: str) -> list:
+        # Called with the lock held
+        scheme = uri.split('://', 1)[0]
+        items = []
+        for item_id in uri.rsplit('/', 1)[-1].split(','):
+            items.append((self.next_item_id, scheme, item_id))
+            self.next_item_id += 1
+        return items
+
+    def playlist_item_xml(self, playlist_item_id: int, scheme: str, item_id: str) -> str:
+        if scheme == 'provider':
+            return f"<Track {attrs(ratingKey=item_id, key=f'/library/metadata/{item_id}', type='track', playlistItemID=playlist_item_id, source='provider://tv.plex.provider.music')}/>"
+        return f"<Track {attrs(ratingKey=item_id, key=f'/library/metadata/{item_id}', type='track', playlistItemID=playlist_item_id, librarySectionID=SECTION_KEY)}/>"
+
+    def handle_playlist_items(self, method: str, rating_key: int, query: dict, start: int, size: int) -> tuple:
+        playlist = self.playlists.get(rating_key)
+        if playlist is None:
+            return 'playlist items', 404, b''
+        if method == 'PUT':
+            with self.lock:
+                playlist['items'].extend(self.uri_items(query.get('uri', '')))
+            return 'add playlist items', 200, container([], size=0)
+        with self.lock:
+            items = [self.playlist_item_xml(*item) for item in playlist['items'][start:start + size]]
+            total = len(playlist['items'])
+        return 'playlist items', 200, container(items, size=len(items), totalSize=total)
+
+    def handle_playlist_item(self, method: str, rating_key: int, playlist_item_id: int, move: bool, query: dict) -> tuple:
+        playlist = self.playlists.get(rating_key)
+        with self.lock:
+            position = next((index for index, item in enumerate(playlist['items']) if item[0] == playlist_item_id), None) if playlist else None
+            if position is None:
+                return 'playlist item', 404, b''
+            item = playlist['items'].pop(position)
+            if method == 'DELETE':
+                return 'remove playlist item', 200, container([], size=0)
+            if not move:
+                playlist['items'].insert(position, item)
+                return 'playlist item', 405, b''
+            after = int(query['after']) if 'after' in query else None
+            index = 0 if after is None else next(index for index, other in enumerate(playlist['items']) if other[0] == after) + 1
+            playlist['items'].insert(index, item)
+        return 'move playlist item', 200, container([], size=0)
+
+    # ---- server lifecycle ----
+
+    def start(self) -> str:
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True  # Otherwise keep-alive replies stall on delayed ACKs
+
+            def respond(self):
+                if mock.latency:
+                    time.sleep(mock.latency)
+                route, status, body = mock.handle(self.command, self.path, self.headers)
+                with mock.lock:
+                    mock.requests[route] += 1
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/xml;charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_PUT = do_POST = do_DELETE = respond
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests.clear()
+
+    def total_requests(self) -> int:
+        with self.lock:
+            return sum(self.requests.values())
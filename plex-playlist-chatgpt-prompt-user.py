@@ -16,14 +16,56 @@
 from plexapi.server import PlexServer
 from plexapi.myplex import MyPlexAccount
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError, NewConnectionError
 from xml.etree import ElementTree as ET
-from urllib.parse import quote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, urlsplit
+import random
+import secrets
 import re
+import os
+import json
+import mmap
+import argparse
+import contextlib
+import hashlib
+import hmac
+import queue
+import sys
+import sqlite3
+import struct
+import threading
+import time
 from unidecode import unidecode
 from fuzzywuzzy import fuzz
 from tqdm import tqdm  # tqdm is a library for progress bars
+try:
+    # Optional: lets match_songs_in_library score a whole playlist at once.
+    import numpy as np
+    from rapidfuzz import fuzz as rapid_fuzz, process as rapid_process
+except ImportError:
+    rapid_process = None
+from array import array
+from collections import Counter, deque, namedtuple
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from itertools import count, groupby
+from bisect import bisect_left
 
-from ppg_config import PLEX_URL, PLEX_TOKEN, SECTION_TITLE, ADMIN_NAME, ADMIN_PASS, FUZZ_AMT, BATCH_SIZE, PLACEHOLDER_ARTIST, PLACEHOLDER_TITLE
+from ppg_config import PLEX_URL, PROVIDER_URL, PLEX_TOKEN, SECTION_TITLE, ADMIN_NAME, ADMIN_PASS, FUZZ_AMT, MAX_URL_LENGTH
+from ppg_config import USE_LIBRARY_INDEX, LIBRARY_PAGE_SIZE, LIBRARY_CACHE_FILE, LIBRARY_INDEX_FILE, RESOLVE_WORKERS, RESOLVER_ORDER
+from ppg_config import SEARCH_CACHE_FILE, SEARCH_CACHE_TTL, SEARCH_CACHE_NEGATIVE_TTL, SEARCH_CACHE_MAX_ENTRIES, SEARCH_VARIANT_WORKERS
+from ppg_config import JOURNAL_DIR, METRICS_LATENCY_BUCKETS
+from ppg_config import USER_TOKEN_CACHE_FILE, USER_TOKEN_TTL, PUBLISH_WORKERS, SYNC_REORDER
+from ppg_config import DAEMON_HOST, DAEMON_PORT, DAEMON_REFRESH_SECONDS, DAEMON_JOBS_KEPT, DAEMON_SECRET_FILE
+from ppg_config import STREAM_FLUSH_SIZE, STREAM_FLUSH_SECONDS, STREAM_POLL_SECONDS
+from ppg_config import MATCH_CHUNK_SIZE, MATCH_BLOCKING, BLOCKING_CANDIDATES, BLOCKING_MAX_POSTINGS
+from ppg_config import HTTP_TIMEOUT, HTTP_POOL_HOSTS, HTTP_MAX_CONNECTIONS_PER_HOST, HTTP_RATE_LIMIT, HTTP_RATE_BURST, HTTP_MAX_RETRIES, HTTP_BACKOFF_BASE, HTTP_BACKOFF_MAX
+
+DATE_PATTERN = r'\d{4}[-\u2013\u2014\u2212/]\d{2}[-\u2013\u2014\u2212/]\d{2}|\d{2}[-\u2013\u2014\u2212/]\d{2}[-\u2013\u2014\u2212/]\d{4}'
+EXCLUDE_PATTERN = r'\b(?:live|concert|sbd)\b'
 
 class Colors:
     RED = '\033[91m'
@@ -33,10 +75,237 @@ class Colors:
     MAGENTA = '\033[95m'
     CYAN = '\033[96m'
     RESET = '\033[0m'
+
+
+class Metrics:
+    # Wall time, call counts and latency histograms per stage and per HTTP
+    # endpoint, plus cache hit counts. Off unless --profile or --metrics is
+    # given; stage times from worker threads add up, so they can be more
+    # than the run's wall time.
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.timings = {}  # (kind, name) -> {'count', 'seconds', 'errors', 'buckets'}
+        self.caches = {}  # name -> [hits, misses]
+
+    def observe(self, kind: str, name: str, seconds: float, error: bool = False):
+        if not self.enabled:
+            return
+        with self.lock:
+            timing = self.timings.setdefault((kind, name), {'count': 0, 'seconds': 0.0, 'errors': 0, 'buckets': [0] * (len(METRICS_LATENCY_BUCKETS) + 1)})
+            timing['count'] += 1
+            timing['seconds'] += seconds
+            timing['errors'] += error
+            timing['buckets'][next((i for i, bound in enumerate(METRICS_LATENCY_BUCKETS) if seconds <= bound), len(METRICS_LATENCY_BUCKETS))] += 1
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage', name, time.perf_counter() - start)
+
+    def cache(self, name: str, hit: bool):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.caches.setdefault(name, [0, 0])[0 if hit else 1] += 1
+
+    def quantile(self, buckets: list, fraction: float) -> float:
+        # Upper bound of the bucket the quantile falls in (inf past the last one)
+        target = fraction * sum(buckets)
+        seen = 0
+        for bound, bucket_count in zip(METRICS_LATENCY_BUCKETS + [float('inf')], buckets):
+            seen += bucket_count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+    def summary_lines(self) -> list:
+        lines = []
+        with self.lock:
+            timings = sorted(self.timings.items(), key=lambda item: (item[0][0] != 'stage', -item[1]['seconds']))
+            caches = sorted(self.caches.items())
+        for (kind, name), timing in timings:
+            errors = f", {timing['errors']} errors" if timing['errors'] else ""
+            lines.append(f"{kind:<5} {name}: {timing['count']} calls, {timing['seconds']:.2f}s, "
+                         f"p50 <= {self.quantile(timing['buckets'], 0.5) * 1000:g}ms, p95 <= {self.quantile(timing['buckets'], 0.95) * 1000:g}ms{errors}")
+        for name, (hits, misses) in caches:
+            lines.append(f"cache {name}: {hits} hits, {misses} misses ({hits / max(hits + misses, 1):.0%} hit rate)")
+        return lines
+
+    def to_json(self) -> dict:
+        with self.lock:
+            return {
+                'latency_buckets': METRICS_LATENCY_BUCKETS,
+                'stages': {name: dict(timing) for (kind, name), timing in self.timings.items() if kind == 'stage'},
+                'http': {name: dict(timing) for (kind, name), timing in self.timings.items() if kind == 'http'},
+                'caches': {name: {'hits': hits, 'misses': misses} for name, (hits, misses) in self.caches.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        error_lines = []
+        with self.lock:
+            timings = sorted(self.timings.items())
+            caches = sorted(self.caches.items())
+        for kind in ('stage', 'http'):
+            metric = f"ppg_{kind}_seconds"
+            label = 'stage' if kind == 'stage' else 'endpoint'
+            lines.append(f"# TYPE {metric} histogram")
+            for (timing_kind, name), timing in timings:
+                if timing_kind != kind:
+                    continue
+                escaped = name.replace('\\', '\\\\').replace('"', '\\"')
+                cumulative = 0
+                for bound, bucket_count in zip(METRICS_LATENCY_BUCKETS + ['+Inf'], timing['buckets']):
+                    cumulative += bucket_count
+                    lines.append(f'{metric}_bucket{{{label}="{escaped}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{{label}="{escaped}"}} {timing["seconds"]}')
+                lines.append(f'{metric}_count{{{label}="{escaped}"}} {timing["count"]}')
+                if kind == 'http':
+                    error_lines.append(f'ppg_http_errors_total{{{label}="{escaped}"}} {timing["errors"]}')
+        # Each metric's samples have to be one block, so the error counters
+        # go after the whole histogram
+        lines.append("# TYPE ppg_http_errors_total counter")
+        lines.extend(error_lines)
+        lines.append("# TYPE ppg_cache_lookups_total counter")
+        for name, (hits, misses) in caches:
+            lines.append(f'ppg_cache_lookups_total{{cache="{name}",result="hit"}} {hits}')
+            lines.append(f'ppg_cache_lookups_total{{cache="{name}",result="miss"}} {misses}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        # Prometheus text for .prom files (e.g. for node_exporter's textfile
+        # collector), JSON for anything else.
+        with open(path, 'w', encoding='utf-8') as file:
+            if path.endswith('.prom'):
+                file.write(self.to_prometheus())
+            else:
+                json.dump(self.to_json(), file, indent=2)
+
+
+metrics = Metrics()
     
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class BoundedHTTPConnectionPool(HTTPConnectionPool):
+    # With pool_block=True a request waits for a free connection; wait at
+    # most HTTP_TIMEOUT instead of forever (urllib3 raises EmptyPoolError).
+    def urlopen(self, *args, pool_timeout=None, **kwargs):
+        return super().urlopen(*args, pool_timeout=HTTP_TIMEOUT if pool_timeout is None else pool_timeout, **kwargs)
+
+
+class BoundedHTTPSConnectionPool(HTTPSConnectionPool):
+    def urlopen(self, *args, pool_timeout=None, **kwargs):
+        return super().urlopen(*args, pool_timeout=HTTP_TIMEOUT if pool_timeout is None else pool_timeout, **kwargs)
+
+
+class BoundedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': BoundedHTTPConnectionPool, 'https': BoundedHTTPSConnectionPool}
+
+
+class HttpSession(requests.Session):
+    # One pooled, keep-alive session shared by our own requests and by
+    # PlexServer/MyPlexAccount. Every request waits for its host's token
+    # bucket, and 429/5xx answers are retried with jittered exponential
+    # backoff. Requests that create or append (POST, and PUT to a playlist's
+    # items) are only retried on 429, since a 5xx may still have been acted
+    # on. A POST or PUT that fails on the network is only re-sent when it
+    # never reached the server (connect timeout or connection refused).
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self):
+        super().__init__()
+        adapter = BoundedHTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_MAX_CONNECTIONS_PER_HOST, pool_block=True)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+
+    def bucket(self, host: str) -> TokenBucket:
+        with self.buckets_lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(HTTP_RATE_LIMIT, HTTP_RATE_BURST)
+            return self.buckets[host]
+
+    def backoff(self, attempt: int, response=None) -> float:
+        delay = random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        return delay
+
+    @staticmethod
+    def never_sent(error) -> bool:
+        # True when the connection was never made, so the server can't have
+        # seen the request
+        if isinstance(error, (requests.ConnectTimeout, EmptyPoolError)):
+            return True
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+
+    def endpoint(self, method: str, url: str) -> str:
+        # Ids are folded out of the path so each endpoint is counted once
+        return f"{method.upper()} {re.sub(r'/[0-9]+(?=/|$)', '/{id}', urlsplit(url).path)}"
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault('timeout', HTTP_TIMEOUT)
+        bucket = self.bucket(urlsplit(url).netloc)
+        method = method.upper()
+        appends = method == 'POST' or (method == 'PUT' and urlsplit(url).path.endswith('/items'))
+        retry_statuses = {429} if appends else self.RETRY_STATUSES
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            bucket.acquire()
+            start = time.perf_counter()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout, EmptyPoolError) as e:
+                metrics.observe('http', self.endpoint(method, url), time.perf_counter() - start, error=True)
+                if attempt == HTTP_MAX_RETRIES or (method in ('POST', 'PUT') and not self.never_sent(e)):
+                    raise
+                time.sleep(self.backoff(attempt))
+                continue
+            metrics.observe('http', self.endpoint(method, url), time.perf_counter() - start, error=response.status_code >= 400)
+            if response.status_code not in retry_statuses or attempt == HTTP_MAX_RETRIES:
+                return response
+            # Hand the connection back first; a streamed response would
+            # otherwise hold it for good
+            response.close()
+            time.sleep(self.backoff(attempt, response))
+
+
+http_session = HttpSession()
+
+
 def initialize_plex_server(plex_url: str, plex_token: str) -> PlexServer:
     try:
-        return PlexServer(plex_url, plex_token)
+        return PlexServer(plex_url, plex_token, session=http_session)
     except Exception as e:
         print(f"Error initializing Plex Server: {e}")
         exit()
@@ -70,24 +339,640 @@ def alternate_name_variation(artist_name: str) -> str:
         return artist_name.replace(" & ", " and ")
     else:
         return artist_name
-        
-        
+
+
+EXCLUDE_ALBUM_DATE = 1
+EXCLUDE_ALBUM_WORD = 2
+EXCLUDE_TRACK_WORD = 4
+
+
+def is_excluded_album(album_title: str) -> bool:
+    return bool(re.search(DATE_PATTERN, album_title, re.IGNORECASE) or re.search(EXCLUDE_PATTERN, album_title, re.IGNORECASE))
+
+
+def is_excluded_track(track_title: str) -> bool:
+    return bool(re.search(EXCLUDE_PATTERN, track_title, re.IGNORECASE))
+
+
+def exclusion_flags(album_title: str, track_title: str) -> int:
+    flags = 0
+    if re.search(DATE_PATTERN, album_title, re.IGNORECASE):
+        flags |= EXCLUDE_ALBUM_DATE
+    if re.search(EXCLUDE_PATTERN, album_title, re.IGNORECASE):
+        flags |= EXCLUDE_ALBUM_WORD
+    if is_excluded_track(track_title):
+        flags |= EXCLUDE_TRACK_WORD
+    return flags
+
+
+# A lightweight stand-in for a plexapi Track, holding just what matching needs.
+# Playlists are built from ratingKeys, so the full Track is never fetched.
+IndexedTrack = namedtuple('IndexedTrack', ['ratingKey', 'artist', 'title'])
+
+
+def blocking_keys(simplified: str, field: str) -> set:
+    # Whole words plus the character trigrams of each word, tagged with the
+    # field they came from ('a' artist, 't' title) so they can't cross-match.
+    keys = set()
+    for token in simplified.split():
+        keys.add(f"{field}#{token}")
+        padded = f" {token} "
+        for i in range(len(padded) - 2):
+            keys.add(f"{field}{padded[i:i + 3]}")
+    return keys
+
+
+class BlockingIndex:
+    # Inverted index from blocking keys to track positions in LibraryIndex.columns().
+    # A lookup only counts shared keys, rarest first, and stops once
+    # BLOCKING_MAX_POSTINGS positions have been read, so its cost stays
+    # about the same however big the library gets. Only the best
+    # BLOCKING_CANDIDATES tracks are passed on to fuzzy scoring.
+    def __init__(self, library_index):
+        artist_keys, titles, track_artists, _ = library_index.columns()
+        artist_blocking_keys = []
+        for simplified_artist in artist_keys:
+            keys = blocking_keys(simplified_artist, 'a')
+            variant = library_index.artist_variants.get(simplified_artist)
+            if variant:
+                keys |= blocking_keys(variant, 'a')
+            artist_blocking_keys.append(keys)
+
+        self.postings = {}
+        for position, (simplified_title, artist_position) in enumerate(zip(titles, track_artists)):
+            for key in artist_blocking_keys[artist_position] | blocking_keys(simplified_title, 't'):
+                posting = self.postings.get(key)
+                if posting is None:
+                    posting = self.postings[key] = array('I')
+                posting.append(position)
+
+    def posting(self, key: str):
+        return self.postings.get(key)
+
+    def candidates(self, simplified_artist: str, simplified_title: str) -> list:
+        keys = blocking_keys(simplified_artist, 'a') | blocking_keys(simplified_title, 't')
+        postings = [self.posting(key) for key in keys]
+        postings = sorted((posting for posting in postings if posting is not None), key=len)
+        counts = Counter()
+        budget = BLOCKING_MAX_POSTINGS
+        for posting in postings:
+            if counts and len(posting) > budget:
+                break
+            counts.update(posting)
+            budget -= len(posting)
+        return [position for position, _ in counts.most_common(BLOCKING_CANDIDATES)]
+
+
+class LibraryIndex:
+    def __init__(self):
+        self.artists = {}  # simplified artist -> list of (simplified title, IndexedTrack)
+        self.artist_variants = {}  # simplified artist -> simplified "and" <-> "&" variant
+        self.matches = {}  # (simplified artist, simplified title) -> IndexedTrack or None
+        self._columns = None
+        self._blocking = None
+        # Resolver threads share the index, so the columns and the blocking
+        # index are built by whichever gets here first while the rest wait
+        self.build_lock = threading.RLock()
+
+    def __len__(self):
+        return sum(len(tracks) for tracks in self.artists.values())
+
+    def add(self, track: IndexedTrack, simplified_artist: str = None, simplified_title: str = None):
+        if simplified_artist is None:
+            simplified_artist = simplify_string(track.artist)
+        if simplified_title is None:
+            simplified_title = simplify_string(track.title)
+        if simplified_artist not in self.artists:
+            variant = simplify_string(alternate_name_variation(track.artist))
+            if variant != simplified_artist:
+                self.artist_variants[simplified_artist] = variant
+        self.artists.setdefault(simplified_artist, []).append((simplified_title, track))
+        self._columns = None
+        self._blocking = None
+
+    def columns(self):
+        # Flat lists of the index for the batch matcher: every artist key,
+        # then per track its title, the position of its artist and the track.
+        with self.build_lock:
+            if self._columns is not None:
+                return self._columns
+            artist_keys = list(self.artists)
+            titles, track_artists, tracks = [], [], []
+            for artist_position, simplified_artist in enumerate(artist_keys):
+                for simplified_title, track in self.artists[simplified_artist]:
+                    titles.append(simplified_title)
+                    track_artists.append(artist_position)
+                    tracks.append(track)
+            self._columns = (artist_keys, titles, track_artists, tracks)
+            return self._columns
+
+    def blocking_index(self) -> BlockingIndex:
+        with self.build_lock:
+            if self._blocking is None:
+                self._blocking = BlockingIndex(self)
+            return self._blocking
+
+    def matching_artists(self, simplified_input_artist: str):
+        if simplified_input_artist in self.artists:
+            yield simplified_input_artist
+        for simplified_library_artist in self.artists:
+            if simplified_library_artist == simplified_input_artist:
+                continue
+            if fuzz.ratio(simplified_input_artist, simplified_library_artist) > FUZZ_AMT:
+                yield simplified_library_artist
+
+    def best_candidate(self, simplified_input_artist: str, simplified_input_title: str, positions: list):
+        artist_keys, titles, track_artists, tracks = self.columns()
+        best_track, best_score = None, 0
+        for position in positions:
+            artist_score = fuzz.ratio(simplified_input_artist, artist_keys[track_artists[position]])
+            if artist_score <= FUZZ_AMT:
+                continue
+            title_score = fuzz.ratio(simplified_input_title, titles[position])
+            if title_score > FUZZ_AMT and artist_score + title_score > best_score:
+                best_track, best_score = tracks[position], artist_score + title_score
+        return best_track
+
+    def find_simplified(self, simplified_input_artist: str, simplified_input_title: str):
+        memoized = (simplified_input_artist, simplified_input_title) in self.matches
+        metrics.cache('match memo', memoized)
+        if memoized:
+            return self.matches[(simplified_input_artist, simplified_input_title)]
+        if MATCH_BLOCKING:
+            positions = self.blocking_index().candidates(simplified_input_artist, simplified_input_title)
+            return self.best_candidate(simplified_input_artist, simplified_input_title, positions)
+        for simplified_library_artist in self.matching_artists(simplified_input_artist):
+            for simplified_library_title, track in self.artists[simplified_library_artist]:
+                if fuzz.ratio(simplified_input_title, simplified_library_title) > FUZZ_AMT:
+                    return track
+        return None
+
+    def find(self, artist_name: str, track_title: str):
+        return self.find_simplified(simplify_string(artist_name), simplify_string(track_title))
+
+
+# Layout of the LIBRARY_INDEX_FILE. The file starts with the magic, then the
+# offset and length of a JSON block at the end that says where each section
+# is. Sections are flat arrays, 8-byte aligned, read in place through mmap:
+#   string_offsets, string_data   every distinct string once (UTF-8), by id
+#   artist_keys                   simplified artist string ids, sorted
+#   artist_starts, artist_counts  each artist's tracks
+#   rating_keys                   int64 per track
+#   track_artists, track_titles   artist position, simplified title id
+#   artist_names, title_names     string ids of the names as Plex has them
+#   posting_keys, posting_offsets, postings   the BlockingIndex, keys sorted
+# Tracks are grouped by artist. Like the in-memory index, the file only
+# holds tracks that pass the date/live/concert/sbd exclusions, which are
+# applied once while it's written.
+COMPACT_INDEX_MAGIC = b'PPGIDX\x00\x00'
+COMPACT_INDEX_HEADER = struct.Struct('<8sQQ')
+
+# Bump this whenever the layout above or simplify_string() changes.
+COMPACT_INDEX_SCHEMA = 2
+
+
+class StringColumn(Sequence):
+    # A column of string ids in a CompactLibraryIndex, decoded on access.
+    def __init__(self, index, string_ids):
+        self.index = index
+        self.string_ids = string_ids
+
+    def __len__(self):
+        return len(self.string_ids)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        return self.index.string(self.string_ids[position])
+
+
+class TrackColumn(Sequence):
+    # IndexedTracks of a CompactLibraryIndex, built on access.
+    def __init__(self, index, size: int):
+        self.index = index
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if not -self.size <= position < self.size:
+            raise IndexError(position)
+        return self.index.track(position % self.size)
+
+
+class CompactArtists(Mapping):
+    # Read-only stand-in for LibraryIndex.artists on a CompactLibraryIndex.
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index.artist_keys)
+
+    def __iter__(self):
+        return iter(StringColumn(self.index, self.index.artist_keys))
+
+    def __getitem__(self, simplified_artist: str):
+        index = self.index
+        artist_position = index.search_sorted(index.artist_keys, simplified_artist)
+        if artist_position is None:
+            raise KeyError(simplified_artist)
+        start = index.artist_starts[artist_position]
+        return [(index.string(index.track_titles[position]), index.track(position))
+                for position in range(start, start + index.artist_counts[artist_position])]
+
+
+class CompactBlockingIndex(BlockingIndex):
+    # The BlockingIndex stored in a CompactLibraryIndex file; postings are
+    # slices of the mapped file rather than arrays in memory.
+    def __init__(self, library_index):
+        self.index = library_index
+
+    def posting(self, key: str):
+        index = self.index
+        key_position = index.search_sorted(index.posting_keys, key)
+        if key_position is None:
+            return None
+        return index.postings[index.posting_offsets[key_position]:index.posting_offsets[key_position + 1]]
+
+
+class CompactLibraryIndex(LibraryIndex):
+    # A LibraryIndex read straight from a LIBRARY_INDEX_FILE with mmap, so it
+    # loads in no time, costs a few dozen bytes of shared, read-only page
+    # cache per track instead of Python objects, and every process using the
+    # same file shares one copy. Only the match memo lives in memory.
+    def __init__(self, path: str):
+        super().__init__()
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < COMPACT_INDEX_HEADER.size:
+            raise ValueError(f"{path} is not a library index file")
+        magic, meta_offset, meta_length = COMPACT_INDEX_HEADER.unpack_from(self.map)
+        if magic != COMPACT_INDEX_MAGIC:
+            raise ValueError(f"{path} is not a library index file")
+        self.meta = json.loads(self.map[meta_offset:meta_offset + meta_length])
+        if self.meta.get('schema') != COMPACT_INDEX_SCHEMA or self.meta.get('byteorder') != sys.byteorder:
+            raise ValueError(f"{path} was written by another version or machine")
+
+        view = memoryview(self.map)
+        self.sections = {name: view[offset:offset + length].cast(typecode)
+                         for name, (offset, length, typecode) in self.meta['sections'].items()}
+        for name, section in self.sections.items():
+            setattr(self, name, section)
+        self.artists = CompactArtists(self)
+
+    def __len__(self):
+        return len(self.rating_keys)
+
+    def string_bytes(self, string_id: int) -> bytes:
+        return self.string_data[self.string_offsets[string_id]:self.string_offsets[string_id + 1]].tobytes()
+
+    def string(self, string_id: int) -> str:
+        return str(self.string_data[self.string_offsets[string_id]:self.string_offsets[string_id + 1]], 'utf-8')
+
+    def track(self, position: int) -> IndexedTrack:
+        return IndexedTrack(self.rating_keys[position], self.string(self.artist_names[position]), self.string(self.title_names[position]))
+
+    def search_sorted(self, string_ids, value: str):
+        # Binary search over string ids sorted by their UTF-8 bytes; returns
+        # the position of value or None.
+        target = value.encode('utf-8')
+        low, high = 0, len(string_ids)
+        while low < high:
+            middle = (low + high) // 2
+            if self.string_bytes(string_ids[middle]) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(string_ids) and self.string_bytes(string_ids[low]) == target:
+            return low
+        return None
+
+    def columns(self):
+        if self._columns is None:
+            self._columns = (StringColumn(self, self.artist_keys), StringColumn(self, self.track_titles),
+                             self.track_artists, TrackColumn(self, len(self)))
+        return self._columns
+
+    def blocking_index(self) -> BlockingIndex:
+        if self._blocking is None:
+            self._blocking = CompactBlockingIndex(self)
+        return self._blocking
+
+
+def match_candidates(music_library: LibraryIndex, queries: list):
+    # Blocked batch matching: gather each song's candidate tracks, then score
+    # every (song, candidate) pair in one rapidfuzz cpdist call per field.
+    artist_keys, titles, track_artists, tracks = music_library.columns()
+    blocking = music_library.blocking_index()
+    for start in range(0, len(queries), MATCH_CHUNK_SIZE):
+        chunk = queries[start:start + MATCH_CHUNK_SIZE]
+        rows, positions = [], []
+        for row, query in enumerate(chunk):
+            candidates = blocking.candidates(*query)
+            rows.extend([row] * len(candidates))
+            positions.extend(candidates)
+        best = {}
+        if positions:
+            artist_scores = rapid_process.cpdist([chunk[row][0] for row in rows], [artist_keys[track_artists[position]] for position in positions], scorer=rapid_fuzz.ratio, dtype=np.uint8, workers=-1)
+            title_scores = rapid_process.cpdist([chunk[row][1] for row in rows], [titles[position] for position in positions], scorer=rapid_fuzz.ratio, dtype=np.uint8, workers=-1)
+            for row, position, artist_score, title_score in zip(rows, positions, artist_scores.tolist(), title_scores.tolist()):
+                if artist_score > FUZZ_AMT and title_score > FUZZ_AMT and artist_score + title_score > best.get(row, (0, None))[0]:
+                    best[row] = (artist_score + title_score, tracks[position])
+        for row, query in enumerate(chunk):
+            music_library.matches[query] = best[row][1] if row in best else None
+
+
+def match_songs_in_library(music_library, songs: list):
+    # Match the whole playlist against the index in one go and remember the
+    # results, so the 'local' resolver only has to look them up. With
+    # rapidfuzz installed the scoring is vectorized over all cores: against
+    # each song's blocking candidates when MATCH_BLOCKING is on, otherwise
+    # against every artist and title with cdist. Without rapidfuzz the songs
+    # are matched one by one.
+    if not isinstance(music_library, LibraryIndex):
+        return
+    with metrics.stage('fuzzy scoring'):
+        batch_match_songs(music_library, songs)
+
+
+def batch_match_songs(music_library: LibraryIndex, songs: list):
+    queries = [(simplify_string(artist), simplify_string(title)) for artist, title in (song.split(' - ', 1) for song in songs)]
+    queries = [query for query in dict.fromkeys(queries) if query not in music_library.matches]
+    artist_keys, titles, track_artists, tracks = music_library.columns()
+    if rapid_process is None or not tracks or (MATCH_BLOCKING and not hasattr(rapid_process, 'cpdist')):
+        for query in queries:
+            music_library.matches[query] = music_library.find_simplified(*query)
+        return
+    if MATCH_BLOCKING:
+        match_candidates(music_library, queries)
+        return
+
+    # cdist would otherwise decode a CompactLibraryIndex's strings per chunk
+    artist_keys, titles = list(artist_keys), list(titles)
+    track_artists = np.asarray(track_artists)
+    for start in range(0, len(queries), MATCH_CHUNK_SIZE):
+        chunk = queries[start:start + MATCH_CHUNK_SIZE]
+        artist_scores = rapid_process.cdist([artist for artist, _ in chunk], artist_keys, scorer=rapid_fuzz.ratio, dtype=np.uint8, workers=-1)
+        title_scores = rapid_process.cdist([title for _, title in chunk], titles, scorer=rapid_fuzz.ratio, dtype=np.uint8, workers=-1)
+        track_artist_scores = artist_scores[:, track_artists]
+        is_match = (track_artist_scores > FUZZ_AMT) & (title_scores > FUZZ_AMT)
+        combined = np.where(is_match, track_artist_scores.astype(np.uint16) + title_scores, 0)
+        best = combined.argmax(axis=1)
+        for row, query in enumerate(chunk):
+            music_library.matches[query] = tracks[best[row]] if combined[row, best[row]] else None
+
+
+def iter_library_tracks(music_library, filters: str = ''):
+    # Page through the raw XML of every track in the section; this avoids
+    # building a full plexapi object for each of them. Filters go straight
+    # into the URL because Plex wants operators like 'updatedAt>>=' unescaped.
+    server = music_library._server
+    key = f"/library/sections/{music_library.key}/all"
+    if filters:
+        key += f"?{filters}"
+    start = 0
+    while True:
+        page_params = {
+            'type': 10,  # 10 = track
+            'X-Plex-Container-Start': start,
+            'X-Plex-Container-Size': LIBRARY_PAGE_SIZE,
+        }
+        with metrics.stage('library paging'):
+            page = server.query(key, params=page_params)
+        tracks = page.findall('Track') if page is not None else []
+        yield from tracks
+        start += len(tracks)
+        if len(tracks) < LIBRARY_PAGE_SIZE:
+            break
+
+
+# Bump this whenever the tracks table or simplify_string() changes,
+# so existing cache files get rebuilt instead of misread.
+LIBRARY_CACHE_SCHEMA = 1
+
+
+def library_cache_row(track) -> tuple:
+    artist = track.get('grandparentTitle') or ''
+    title = track.get('title') or ''
+    flags = exclusion_flags(track.get('parentTitle') or '', title)
+    updated_at = int(track.get('updatedAt') or track.get('addedAt') or 0)
+    return (int(track.get('ratingKey')), artist, title, simplify_string(artist), simplify_string(title), flags, updated_at)
+
+
+def reset_library_cache(conn: sqlite3.Connection, music_library):
+    conn.execute("DROP TABLE IF EXISTS tracks")
+    conn.execute("""
+        CREATE TABLE tracks (
+            ratingKey INTEGER PRIMARY KEY,
+            artist TEXT NOT NULL,
+            title TEXT NOT NULL,
+            simple_artist TEXT NOT NULL,
+            simple_title TEXT NOT NULL,
+            flags INTEGER NOT NULL,
+            updatedAt INTEGER NOT NULL
+        )""")
+    conn.execute("DELETE FROM meta")
+    conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [
+        ('schema', str(LIBRARY_CACHE_SCHEMA)),
+        ('section', music_library.uuid),
+    ])
+
+
+def refresh_library_cache(conn: sqlite3.Connection, music_library, full: bool) -> int:
+    if full:
+        reset_library_cache(conn, music_library)
+        filters = ''
+    else:
+        watermark = conn.execute("SELECT MAX(updatedAt) FROM tracks").fetchone()[0] or 0
+        # '>>=' is Plex's "greater than"; step back a second so edits made
+        # in the same second as the last sync aren't missed.
+        filters = f"updatedAt>>={watermark - 1}"
+
+    refreshed = 0
+    rows = []
+    for track in iter_library_tracks(music_library, filters):
+        rows.append(library_cache_row(track))
+        if len(rows) >= LIBRARY_PAGE_SIZE:
+            conn.executemany("INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            refreshed += len(rows)
+            rows = []
+    conn.executemany("INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    return refreshed + len(rows)
+
+
+def sync_library_cache(music_library, cache_file: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(cache_file)
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        full = meta.get('schema') != str(LIBRARY_CACHE_SCHEMA) or meta.get('section') != music_library.uuid
+        if full:
+            print(f"{Colors.YELLOW}Library cache missing or out of date, rebuilding it.{Colors.RESET}")
+        refreshed = refresh_library_cache(conn, music_library, full)
+
+    if not full:
+        # A delta can't see deleted tracks, so if the counts disagree the
+        # section was rescanned with removals and the cache is rebuilt.
+        cached_count = conn.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+        if cached_count != music_library.totalViewSize(libtype='track'):
+            print(f"{Colors.YELLOW}Library has changed since the last sync, rebuilding the cache.{Colors.RESET}")
+            with conn:
+                refreshed = refresh_library_cache(conn, music_library, True)
+        else:
+            print(f"{Colors.BLUE}Refreshed {refreshed} tracks in the library cache.{Colors.RESET}")
+    return conn
+
+
+def build_library_index(music_library) -> LibraryIndex:
+    with metrics.stage('library index'):
+        return load_library_index(music_library)
+
+
+def load_library_index(music_library) -> LibraryIndex:
+    if LIBRARY_INDEX_FILE:
+        return load_compact_index(music_library, LIBRARY_INDEX_FILE)
+
+    index = LibraryIndex()
+    if LIBRARY_CACHE_FILE:
+        conn = sync_library_cache(music_library, LIBRARY_CACHE_FILE)
+        rows = conn.execute("SELECT ratingKey, artist, title, simple_artist, simple_title FROM tracks WHERE flags = 0")
+        for rating_key, artist, title, simplified_artist, simplified_title in rows:
+            index.add(IndexedTrack(rating_key, artist, title), simplified_artist, simplified_title)
+        conn.close()
+        return index
+
+    for track in iter_library_tracks(music_library):
+        album_title = track.get('parentTitle') or ''
+        track_title = track.get('title') or ''
+        if exclusion_flags(album_title, track_title):
+            continue
+        index.add(IndexedTrack(int(track.get('ratingKey')), track.get('grandparentTitle') or '', track_title))
+    return index
+
+
+def load_compact_index(music_library, index_file: str) -> CompactLibraryIndex:
+    # Map the index file if it was written for the library as it is now,
+    # otherwise rebuild it, from the SQLite cache when there is one.
+    signature = [music_library.uuid, *library_signature(music_library)]
+    try:
+        index = CompactLibraryIndex(index_file)
+        if index.meta['signature'] == signature:
+            return index
+    except (OSError, ValueError):
+        pass
+
+    print(f"{Colors.YELLOW}Library index file missing or out of date, rebuilding it.{Colors.RESET}")
+    if LIBRARY_CACHE_FILE:
+        conn = sync_library_cache(music_library, LIBRARY_CACHE_FILE)
+        write_compact_index(index_file, conn.execute("SELECT ratingKey, artist, title, simple_artist, simple_title FROM tracks WHERE flags = 0"), signature)
+        conn.close()
+    else:
+        rows = (library_cache_row(track) for track in iter_library_tracks(music_library))
+        write_compact_index(index_file, (row[:5] for row in rows if not row[5]), signature)
+    return CompactLibraryIndex(index_file)
+
+
+def write_compact_index(index_file: str, rows, signature: list):
+    # rows: (ratingKey, artist, title, simplified artist, simplified title)
+    # of the tracks that aren't excluded. Written to a temporary file and
+    # renamed into place, so other processes keep reading the old index
+    # until they reopen it.
+    rows = sorted(rows, key=lambda row: row[3].encode('utf-8'))
+
+    strings = {}  # string -> id
+
+    def intern(value: str) -> int:
+        string_id = strings.get(value)
+        if string_id is None:
+            string_id = strings[value] = len(strings)
+        return string_id
+
+    artist_keys = sorted({row[3] for row in rows}, key=lambda value: value.encode('utf-8'))
+    artist_positions = {simplified_artist: position for position, simplified_artist in enumerate(artist_keys)}
+    artist_starts, artist_counts = array('I', [0] * len(artist_keys)), array('I', [0] * len(artist_keys))
+    artist_blocking_keys = [None] * len(artist_keys)
+    rating_keys, track_artists, track_titles, artist_names, title_names = array('q'), array('I'), array('I'), array('I'), array('I')
+    postings = {}
+
+    for position, (rating_key, artist, title, simplified_artist, simplified_title) in enumerate(rows):
+        artist_position = artist_positions[simplified_artist]
+        rating_keys.append(rating_key)
+        track_artists.append(artist_position)
+        track_titles.append(intern(simplified_title))
+        artist_names.append(intern(artist))
+        title_names.append(intern(title))
+        if artist_blocking_keys[artist_position] is None:
+            artist_starts[artist_position] = position
+            keys = blocking_keys(simplified_artist, 'a')
+            variant = simplify_string(alternate_name_variation(artist))
+            if variant != simplified_artist:
+                keys |= blocking_keys(variant, 'a')
+            artist_blocking_keys[artist_position] = keys
+        artist_counts[artist_position] += 1
+        for key in artist_blocking_keys[artist_position] | blocking_keys(simplified_title, 't'):
+            posting = postings.get(key)
+            if posting is None:
+                posting = postings[key] = array('I')
+            posting.append(position)
+
+    posting_keys, posting_offsets, posting_positions = array('I'), array('I', [0]), array('I')
+    for key in sorted(postings, key=lambda value: value.encode('utf-8')):
+        posting_keys.append(intern(key))
+        posting_positions.extend(postings[key])
+        posting_offsets.append(len(posting_positions))
+    artist_key_ids = array('I', (intern(simplified_artist) for simplified_artist in artist_keys))
+
+    string_offsets, string_data = array('I', [0]), bytearray()
+    for value in strings:
+        string_data += value.encode('utf-8')
+        string_offsets.append(len(string_data))
+
+    sections = {
+        'string_offsets': string_offsets, 'string_data': string_data,
+        'artist_keys': artist_key_ids, 'artist_starts': artist_starts, 'artist_counts': artist_counts,
+        'rating_keys': rating_keys, 'track_artists': track_artists, 'track_titles': track_titles,
+        'artist_names': artist_names, 'title_names': title_names,
+        'posting_keys': posting_keys, 'posting_offsets': posting_offsets, 'postings': posting_positions,
+    }
+    meta = {'schema': COMPACT_INDEX_SCHEMA, 'byteorder': sys.byteorder, 'signature': signature,
+            'tracks': len(rows), 'sections': {}}
+    temporary_file = f"{index_file}.{os.getpid()}.tmp"
+    with open(temporary_file, 'wb') as file:
+        file.write(bytes(COMPACT_INDEX_HEADER.size))
+        for name, section in sections.items():
+            file.write(bytes(-file.tell() % 8))
+            meta['sections'][name] = [file.tell(), len(section) * getattr(section, 'itemsize', 1), getattr(section, 'typecode', 'B')]
+            file.write(section)
+        meta_bytes = json.dumps(meta).encode('utf-8')
+        meta_offset = file.tell()
+        file.write(meta_bytes)
+        file.seek(0)
+        file.write(COMPACT_INDEX_HEADER.pack(COMPACT_INDEX_MAGIC, meta_offset, len(meta_bytes)))
+    os.replace(temporary_file, index_file)
+
+
 def find_track_in_library(music_library, artist_name: str, track_title: str):
-    artist_search = music_library.search(title=artist_name)
+    if isinstance(music_library, LibraryIndex):
+        with metrics.stage('index lookup'):
+            return music_library.find(artist_name, track_title)
+
+    with metrics.stage('library search'):
+        artist_search = music_library.search(title=artist_name)
     for artist in artist_search:
         simplified_input_artist = simplify_string(artist_name)
         simplified_library_artist = simplify_string(artist.title)
         if fuzz.ratio(simplified_input_artist, simplified_library_artist) > FUZZ_AMT:
-            for album in artist.albums():
-                date_pattern = r'\d{4}[-\u2013\u2014\u2212/]\d{2}[-\u2013\u2014\u2212/]\d{2}|\d{2}[-\u2013\u2014\u2212/]\d{2}[-\u2013\u2014\u2212/]\d{4}'
-                exclude_pattern = r'\b(?:live|concert|sbd)\b'
-                is_date = re.search(date_pattern, album.title, re.IGNORECASE)
-                is_exclude_word = re.search(exclude_pattern, album.title, re.IGNORECASE)
-                
-                if not is_date and not is_exclude_word:
-                    for track in album.tracks():
-                        is_track_exclude_word = re.search(exclude_pattern, track.title, re.IGNORECASE)
-                        if is_track_exclude_word:
+            with metrics.stage('album/track listing'):
+                albums = artist.albums()
+            for album in albums:
+                if not is_excluded_album(album.title):
+                    with metrics.stage('album/track listing'):
+                        tracks = album.tracks()
+                    for track in tracks:
+                        if is_excluded_track(track.title):
                             continue
                         
                         simplified_input_title = simplify_string(track_title)
@@ -98,27 +983,177 @@ def find_track_in_library(music_library, artist_name: str, track_title: str):
     return None
 
 
+def normalize_query(query: str) -> str:
+    return ' '.join(query.casefold().split())
+
+
+class SearchCache:
+    # Tidal search responses stored on disk, keyed by the normalized query.
+    # Searches that came back with no tracks expire sooner than real hits,
+    # and the least recently used entries go once the cache is full.
+    def __init__(self, cache_file: str):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(cache_file, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    query TEXT PRIMARY KEY,
+                    body TEXT NOT NULL,
+                    empty INTEGER NOT NULL,
+                    storedAt REAL NOT NULL,
+                    usedAt REAL NOT NULL
+                )""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_usedAt ON responses (usedAt)")
+
+    def get(self, query: str):
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT body, empty, storedAt FROM responses WHERE query = ?", (query,)).fetchone()
+            if row is None:
+                return None
+            body, empty, stored_at = row
+            if now - stored_at > (SEARCH_CACHE_NEGATIVE_TTL if empty else SEARCH_CACHE_TTL):
+                self.conn.execute("DELETE FROM responses WHERE query = ?", (query,))
+                return None
+            self.conn.execute("UPDATE responses SET usedAt = ? WHERE query = ?", (now, query))
+            return body
+
+    def put(self, query: str, body: str, empty: bool):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (query, body, int(empty), now, now))
+            count = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > SEARCH_CACHE_MAX_ENTRIES:
+                self.conn.execute(
+                    "DELETE FROM responses WHERE query IN (SELECT query FROM responses ORDER BY usedAt LIMIT ?)",
+                    (count - SEARCH_CACHE_MAX_ENTRIES,))
+
+
+search_cache = None
+search_cache_lock = threading.Lock()
+
+
+def get_search_cache():
+    global search_cache
+    if not SEARCH_CACHE_FILE:
+        return None
+    with search_cache_lock:
+        if search_cache is None:
+            search_cache = SearchCache(SEARCH_CACHE_FILE)
+    return search_cache
+
+
 def format_query(artist: str, title: str) -> str:
     # Remove parentheses but include the descriptor in the title
     formatted_title = re.sub(r"[()]", "", title)
     return f"{artist} {formatted_title}"
     
 
+FEATURING_PATTERN = r"\s*[(\[]?\b(?:feat|ft|featuring)\b\.?.*$"
+
+
+def query_variants(artist: str, title: str) -> list:
+    # (query, artist, title) to search Tidal with, the most faithful first:
+    # the full title, then without the descriptor, with "and" / "&" swapped,
+    # without "feat. ..." and without accents. Variants that come out the
+    # same after normalize_query are only searched once.
+    stripped_title = re.sub(r"\(.*?\)", "", title).strip()
+    candidates = [
+        (format_query(artist, title), artist, title),
+        (format_query(artist, stripped_title), artist, stripped_title),
+    ]
+    swapped_artist = alternate_name_variation(artist)
+    candidates.append((format_query(swapped_artist, stripped_title), swapped_artist, stripped_title))
+    solo_artist = re.sub(FEATURING_PATTERN, "", artist, flags=re.IGNORECASE).strip()
+    solo_title = re.sub(FEATURING_PATTERN, "", stripped_title, flags=re.IGNORECASE).strip()
+    if solo_artist and solo_title:
+        candidates.append((format_query(solo_artist, solo_title), solo_artist, solo_title))
+    candidates.append((format_query(unidecode(artist), unidecode(stripped_title)), unidecode(artist), unidecode(stripped_title)))
+
+    variants = {}
+    for variant in candidates:
+        variants.setdefault(normalize_query(variant[0]), variant)
+    return list(variants.values())
+
+
+def track_hub_body(tracks: list) -> str:
+    return f'<MediaContainer><Hub type="track">{"".join(tracks)}</Hub></MediaContainer>'
+
+
+def scan_track_hub(chunks, is_match, cancelled: threading.Event):
+    # Feeds a hubs/search response through a pull parser and checks each
+    # track of the track hub as soon as it's complete. Returns (id of the
+    # first match or None, the track hub read so far as XML, whether the
+    # whole hub was read); (None, None, False) if cancelled.
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    in_track_hub = False
+    tracks = []
+    for chunk in chunks:
+        if cancelled.is_set():
+            return None, None, False
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if element.tag == 'Hub':
+                if event == 'start':
+                    in_track_hub = element.get('type') == 'track'
+                elif in_track_hub:
+                    return None, track_hub_body(tracks), True
+                else:
+                    element.clear()  # Other hubs aren't needed
+            elif event == 'end' and element.tag == 'Track' and in_track_hub:
+                tracks.append(ET.tostring(element, encoding='unicode'))
+                found_id = is_match(element)
+                if found_id:
+                    return found_id, track_hub_body(tracks), False
+    return None, track_hub_body(tracks), True
+
+
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_VARIANT_WORKERS)
+
+
 def search_tidal(plex_token: str, artist: str, title: str):
     date_pattern = r'\d{4}[-\u2013\u2014\u2212/]\d{2}[-\u2013\u2014\u2212/]\d{2}|\d{2}[-\u2013\u2014\u2212/]\d{2}[-\u2013\u2014\u2212/]\d{4}'
     exclude_keywords = ['live', 'concert', 'sbd']
     final_url = ""  # Initialize the final URL as an empty string
     tidal_id = None  # Initialize tidal_id as None
 
-    def perform_search(query):
-        nonlocal final_url
-        encoded_query = quote(query)
-        final_url = f"https://music.provider.plex.tv/hubs/search?query={encoded_query}&X-Plex-Token={plex_token}"
-        response = requests.get(final_url)
-        if response.status_code != 200:
-            print(f"Error: Unable to search Tidal with query '{query}': {response.status_code}")
+    def cached_variant(query: str, input_artist: str, input_title: str):
+        # (True, Tidal id or None) if this query's answer is in the search
+        # cache, (False, None) if it has to be searched
+        search_cache = get_search_cache()
+        if not search_cache:
+            return False, None
+        body = search_cache.get(normalize_query(query))
+        metrics.cache('search', body is not None)
+        if body is None:
+            return False, None
+        is_match = lambda track: attempt_match(track, input_artist, input_title)[1]
+        with metrics.stage('xml parsing'):
+            return True, scan_track_hub([body.encode('utf-8')], is_match, threading.Event())[0]
+
+    def search_variant(query: str, input_artist: str, input_title: str):
+        # Returns the Tidal id of the first matching track for this query, or
+        # None. The response is parsed as it streams in and reading stops at
+        # the first match, or at the end of the track hub.
+        url = f"{PROVIDER_URL}/hubs/search?query={quote(query)}&X-Plex-Token={plex_token}"
+        is_match = lambda track: attempt_match(track, input_artist, input_title)[1]
+        search_cache = get_search_cache()
+        cache_key = normalize_query(query)
+        if cancelled.is_set():
             return None
-        return ET.ElementTree(ET.fromstring(response.text))
+
+        with metrics.stage('provider search'):
+            response = http_session.get(url, stream=True)
+        with response:
+            if response.status_code != 200:
+                print(f"Error: Unable to search Tidal with query '{query}': {response.status_code}")
+                return None
+            with metrics.stage('xml parsing'):
+                found_id, hub_body, complete = scan_track_hub(response.iter_content(chunk_size=8192), is_match, cancelled)
+        # A match stores the tracks read up to it, which finds it again next time
+        if search_cache and hub_body is not None and (found_id or complete):
+            search_cache.put(cache_key, hub_body, '<Track' not in hub_body)
+        return found_id
         
     def attempt_match(track, input_artist, input_title):
         artist_title = track.get('originalTitle')
@@ -156,52 +1191,236 @@ def search_tidal(plex_token: str, artist: str, title: str):
                  fuzz.token_set_ratio(simplified_input_title, simplified_library_title) > FUZZ_AMT)
         return match, track.get('guid').split('/')[-1] if match else None
 
-    # First attempt: Search with the full title, including descriptor without parentheses
-    formatted_query = format_query(artist, title)
-    tree = perform_search(formatted_query)
-    if tree is not None and tree.getroot() is not None:
-        track_hub = tree.find('./Hub[@type="track"]')
-        if track_hub is not None and len(track_hub) > 0:
-            for track in track_hub.findall('./Track'):
-                match, temp_tidal_id = attempt_match(track, artist, title)
-                if match:
-                    tidal_id = temp_tidal_id
-                    break  # Break the loop if a match is found
-
-    # Second attempt: If not found, try again without the descriptor
-    if not tidal_id:  # Only proceed if tidal_id is still None
-        simplified_title = re.sub(r"\(.*?\)", "", title).strip()
-        formatted_query = format_query(artist, simplified_title)
-        tree = perform_search(formatted_query)
-        if tree is not None and tree.getroot() is not None:
-            track_hub = tree.find('./Hub[@type="track"]')
-            if track_hub is not None and len(track_hub) > 0:
-                for track in track_hub.findall('./Track'):
-                    match, temp_tidal_id = attempt_match(track, artist, simplified_title)
-                    if match:
-                        tidal_id = temp_tidal_id
-                        break  # Break the loop if a match is found
+    # The cache is checked first, variant by variant: the first cached match
+    # is the answer and nothing is sent. Otherwise every variant that isn't
+    # cached is searched at once, but they're taken in order: the first one
+    # that matched wins once the ones before it have come back empty, so a
+    # hard song costs one round trip instead of one per attempt.
+    variants = query_variants(artist, title)
+    uncached = []
+    for variant in variants:
+        is_cached, tidal_id = cached_variant(*variant)
+        if tidal_id:
+            return tidal_id, f"{PROVIDER_URL}/hubs/search?query={quote(variant[0])}&X-Plex-Token={plex_token}"
+        if not is_cached:
+            uncached.append(variant)
+    cancelled = threading.Event()
+    futures = [search_executor.submit(search_variant, *variant) for variant in uncached]
+    try:
+        for (query, _, _), future in zip(uncached, futures):
+            tidal_id = future.result()
+            if tidal_id:
+                final_url = f"{PROVIDER_URL}/hubs/search?query={quote(query)}&X-Plex-Token={plex_token}"
+                break
+    finally:
+        cancelled.set()  # Stops any search still reading its response
+        for future in futures:
+            future.cancel()
+    if not tidal_id:
+        final_url = f"{PROVIDER_URL}/hubs/search?query={quote(variants[0][0])}&X-Plex-Token={plex_token}"
 
     return tidal_id, final_url  # Always return two values
     
 
-def add_track_to_playlist(plex_url: str, plex_token: str, tidal_ids: list, playlist_ratingKey: str):
+PROVIDER_URI = "provider://tv.plex.provider.music/library/metadata/"
+
+
+def library_uri(machine_identifier: str) -> str:
+    return f"server://{machine_identifier}/com.plexapp.plugins.library/library/metadata/"
+
+
+def url_batches(base_url: str, ids: list) -> list:
+    # Split ids into %2C-joined groups, each as big as still fits under
+    # MAX_URL_LENGTH once appended to base_url.
+    batches = []
+    batch, url_length = [], len(base_url)
+    for item_id in ids:
+        item_id = quote(str(item_id), safe='')
+        added_length = len(item_id) + (3 if batch else 0)
+        if batch and url_length + added_length > MAX_URL_LENGTH:
+            batches.append(batch)
+            batch, url_length, added_length = [], len(base_url), len(item_id)
+        batch.append(item_id)
+        url_length += added_length
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def create_playlist(plex_url: str, plex_token: str, playlist_name: str, uri_prefix: str, ids: list):
+    # Creates the playlist straight from the first batch of ids and returns
+    # its ratingKey along with the ids that didn't fit in that request.
+    create_url = f"{plex_url}/playlists?type=audio&smart=0&title={quote(playlist_name, safe='')}&uri={quote(uri_prefix, safe='')}"
+    first_batch = url_batches(create_url, ids)[0]
+    response = http_session.post(create_url + "%2C".join(first_batch), headers={'X-Plex-Token': plex_token})
+    response.raise_for_status()
+    playlist = ET.fromstring(response.text).find('Playlist')
+    return playlist.get('ratingKey'), ids[len(first_batch):]
+
+
+def put_playlist_items(add_to_playlist_url: str, plex_token: str, batch_ids: list, batch_number: int) -> bool:
+    response = http_session.put(add_to_playlist_url + "%2C".join(batch_ids), headers={'X-Plex-Token': plex_token})
+
+    if response.status_code == 200:
+        print(f"") ## (f"Tidal tracks added to the playlist successfully in batch {batch_number}.")
+        return True
+    print(f"Server says adding tracks to playlist in batch {batch_number}: {response.status_code}")
+    print(response.text)
+    return False
+
+
+def add_track_to_playlist(plex_url: str, plex_token: str, tidal_ids: list, playlist_ratingKey: str, uri_prefix: str = PROVIDER_URI) -> int:
     if not tidal_ids:
         print("Cannot add tracks to a playlist with no Tidal IDs.")
-        return
-    
-    for i in range(0, len(tidal_ids), BATCH_SIZE):
-        batch_ids = tidal_ids[i:i + BATCH_SIZE]
-        tidal_id_str = "%2C".join(batch_ids)
-        add_to_playlist_url = f"{plex_url}/playlists/{playlist_ratingKey}/items?uri=provider%3A%2F%2Ftv.plex.provider.music%2Flibrary%2Fmetadata%2F{tidal_id_str}"
-        
-        response = requests.put(add_to_playlist_url, headers={'X-Plex-Token': plex_token})
-        
-        if response.status_code == 200:
-            print(f"") ## (f"Tidal tracks added to the playlist successfully in batch {i//BATCH_SIZE + 1}.")
+        return 0
+
+    add_to_playlist_url = f"{plex_url}/playlists/{playlist_ratingKey}/items?uri={quote(uri_prefix, safe='')}"
+    batches = url_batches(add_to_playlist_url, tidal_ids)
+    for batch_number, batch_ids in enumerate(batches, 1):
+        put_playlist_items(add_to_playlist_url, plex_token, batch_ids, batch_number)
+    return len(batches)
+
+
+def publish_playlist(plex_url: str, plex_token: str, machine_identifier: str, playlist_name: str, local_items: list, tidal_ids: list, journal=None):
+    # Local tracks go in first, then Tidal tracks. The playlist is created
+    # with the first batch and the rest are added in as few requests as the
+    # URL length allows. Returns the playlist ratingKey and the request count.
+    # With a journal, a playlist and tracks from an interrupted run are
+    # reused instead of being created or added again.
+    groups = [
+        (library_uri(machine_identifier), [item.ratingKey for item in local_items]),
+        (PROVIDER_URI, tidal_ids),
+    ]
+    playlist_ratingKey = journal.playlist_ratingKey if journal else None
+    request_count = 0
+    all_added = True
+    for uri_prefix, ids in groups:
+        committed = journal.committed.get(uri_prefix, set()) if journal else set()
+        positions = [position for position in range(len(ids)) if position not in committed]
+        while positions:
+            if playlist_ratingKey is None:
+                playlist_ratingKey, remaining_ids = create_playlist(plex_url, plex_token, playlist_name, uri_prefix, [ids[position] for position in positions])
+                if journal:
+                    journal.record({'event': 'created', 'ratingKey': playlist_ratingKey})
+                added, batch_ok = len(positions) - len(remaining_ids), True
+            else:
+                add_to_playlist_url = f"{plex_url}/playlists/{playlist_ratingKey}/items?uri={quote(uri_prefix, safe='')}"
+                batch_ids = url_batches(add_to_playlist_url, [ids[position] for position in positions])[0]
+                added, batch_ok = len(batch_ids), put_playlist_items(add_to_playlist_url, plex_token, batch_ids, request_count + 1)
+            request_count += 1
+            if batch_ok and journal:
+                journal.record({'event': 'added', 'uri': uri_prefix, 'positions': positions[:added]})
+            all_added = all_added and batch_ok
+            positions = positions[added:]
+    if journal and all_added:
+        journal.finish()
+    return playlist_ratingKey, request_count
+
+
+def fetch_playlist_items(plex_url: str, plex_token: str, machine_identifier: str, playlist_ratingKey: str):
+    # Returns ([(uri prefix, id, playlistItemID)] in playlist order, request count)
+    local_uri = library_uri(machine_identifier)
+    items = []
+    request_count = 0
+    while True:
+        response = http_session.get(f"{plex_url}/playlists/{playlist_ratingKey}/items", headers={
+            'X-Plex-Token': plex_token,
+            'X-Plex-Container-Start': str(len(items)),
+            'X-Plex-Container-Size': str(LIBRARY_PAGE_SIZE),
+        })
+        response.raise_for_status()
+        request_count += 1
+        page = ET.fromstring(response.text).findall('Track')
+        for track in page:
+            # Tidal tracks come from the provider rather than a library section
+            from_provider = track.get('source', '').startswith('provider://') or track.get('librarySectionID') is None
+            items.append((PROVIDER_URI if from_provider else local_uri, track.get('ratingKey'), track.get('playlistItemID')))
+        if len(page) < LIBRARY_PAGE_SIZE:
+            return items, request_count
+
+
+def longest_increasing_subsequence(values: list) -> set:
+    # Indexes into values of one longest increasing run (patience sorting)
+    tails, tail_indexes, previous = [], [], [None] * len(values)
+    for index, value in enumerate(values):
+        position = bisect_left(tails, value)
+        if position == len(tails):
+            tails.append(value)
+            tail_indexes.append(index)
+        else:
+            tails[position] = value
+            tail_indexes[position] = index
+        previous[index] = tail_indexes[position - 1] if position else None
+    kept = set()
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        kept.add(index)
+        index = previous[index]
+    return kept
+
+
+def sync_playlist(plex_url: str, plex_token: str, machine_identifier: str, playlist_ratingKey: str, local_items: list, tidal_ids: list) -> dict:
+    # Makes an existing playlist match the resolved list (local tracks, then
+    # Tidal tracks, like publish_playlist) with as few requests as possible:
+    # one fetch of the current items, a DELETE per extra item, batched adds
+    # for missing ones, and with SYNC_REORDER a move for each item that's
+    # out of place. Tracks that are already there are left alone.
+    local_uri = library_uri(machine_identifier)
+    desired = [(local_uri, str(item.ratingKey)) for item in local_items] + [(PROVIDER_URI, str(tidal_id)) for tidal_id in tidal_ids]
+    current, request_count = fetch_playlist_items(plex_url, plex_token, machine_identifier, playlist_ratingKey)
+
+    # Pair every wanted track with an item already in the playlist, if any;
+    # duplicates are paired one to one.
+    available = {}
+    for uri_prefix, item_id, playlist_item_id in current:
+        available.setdefault((uri_prefix, item_id), deque()).append(playlist_item_id)
+    playlist_item_ids = [None] * len(desired)
+    to_add = []
+    for position, key in enumerate(desired):
+        if available.get(key):
+            playlist_item_ids[position] = available[key].popleft()
         else:
-            print(f"Server says adding Tidal tracks to playlist in batch {i//BATCH_SIZE + 1}: {response.status_code}")
-            print(response.text)
+            to_add.append(position)
+    to_remove = [playlist_item_id for remaining in available.values() for playlist_item_id in remaining]
+
+    for playlist_item_id in to_remove:
+        http_session.delete(f"{plex_url}/playlists/{playlist_ratingKey}/items/{playlist_item_id}", headers={'X-Plex-Token': plex_token}).raise_for_status()
+        request_count += 1
+    for uri_prefix, positions in groupby(to_add, key=lambda position: desired[position][0]):
+        request_count += add_track_to_playlist(plex_url, plex_token, [desired[position][1] for position in positions], playlist_ratingKey, uri_prefix)
+
+    # New items are appended, so the order is already right when the kept
+    # ones are in list order and nothing needed adding before them.
+    current_order = {playlist_item_id: index for index, (_, _, playlist_item_id) in enumerate(current)}
+    kept = sorted((position for position in range(len(desired)) if playlist_item_ids[position] is not None), key=lambda position: current_order[playlist_item_ids[position]])
+    moved = 0
+    if SYNC_REORDER and kept + to_add != list(range(len(desired))):
+        # Fetch again for the ids of the new items, then move everything
+        # outside the longest run that's already in order.
+        current, fetch_count = fetch_playlist_items(plex_url, plex_token, machine_identifier, playlist_ratingKey)
+        request_count += fetch_count
+        new_items = {}
+        known = set(playlist_item_ids)
+        for uri_prefix, item_id, playlist_item_id in current:
+            if playlist_item_id not in known:
+                new_items.setdefault((uri_prefix, item_id), deque()).append(playlist_item_id)
+        for position in to_add:
+            if new_items.get(desired[position]):
+                playlist_item_ids[position] = new_items[desired[position]].popleft()
+        position_of = {playlist_item_id: position for position, playlist_item_id in enumerate(playlist_item_ids) if playlist_item_id is not None}
+        order = [position_of[playlist_item_id] for _, _, playlist_item_id in current if playlist_item_id in position_of]
+        in_place = {order[index] for index in longest_increasing_subsequence(order)}
+        for position in range(len(desired)):
+            if position in in_place or playlist_item_ids[position] is None:
+                continue
+            move_url = f"{plex_url}/playlists/{playlist_ratingKey}/items/{playlist_item_ids[position]}/move"
+            if position:
+                move_url += f"?after={playlist_item_ids[position - 1]}"
+            http_session.put(move_url, headers={'X-Plex-Token': plex_token}).raise_for_status()
+            request_count += 1
+            moved += 1
+
+    return {'added': len(to_add), 'removed': len(to_remove), 'moved': moved, 'requests': request_count}
 
 
 def format_log_message(message, total_lines=4):
@@ -209,127 +1428,951 @@ def format_log_message(message, total_lines=4):
     additional_lines = total_lines - current_lines
     return message + '\n' * additional_lines
 
-from plexapi.exceptions import NotFound
+
+def resolve_local(music_library, artist: str, title: str):
+    return find_track_in_library(music_library, artist, title), None
+
+
+def resolve_tidal(music_library, artist: str, title: str):
+    return search_tidal(PLEX_TOKEN, artist, title)
+
+
+# Resolvers are tried in RESOLVER_ORDER and the first match wins. Each takes
+# (music_library, artist, title) and returns (match, search_url).
+RESOLVERS = {
+    'local': resolve_local,
+    'tidal': resolve_tidal,
+}
+
+
+def resolve_song(music_library, song_name: str) -> dict:
+    artist, title = song_name.split(' - ', 1)
+    result = {
+        'artist': artist,
+        'track': title,
+        'source': None,
+        'match': None,
+        'tidal_url': ''
+    }
+    for source in RESOLVER_ORDER:
+        with metrics.stage(f"resolve {source}"):
+            match, search_url = RESOLVERS[source](music_library, artist, title)
+        if search_url:
+            result['tidal_url'] = search_url
+        if match:
+            result['source'] = source
+            result['match'] = match
+            break
+    return result
+
+
+def format_resolution_message(result: dict) -> str:
+    artist, title = result['artist'], result['track']
+    log_message = f"{Colors.YELLOW}------------------------------{Colors.RESET}\n{Colors.BLUE}Processing {artist} - {title}{Colors.RESET}\n"
+    if result['source'] == 'local':
+        log_message += f"{Colors.GREEN}Found in local library: {result['match'].title}{Colors.RESET}\n\n"
+    elif result['source'] == 'tidal':
+        log_message += f"{Colors.CYAN}Found on Tidal: {result['match']}{Colors.RESET}\n\n"
+    else:
+        log_message += f"{Colors.RED}Not found on Tidal or local: {artist} - {title}{Colors.RESET}\n{result['tidal_url']}\n"
+    return format_log_message(log_message, total_lines=4)
+
+
+def redact_token(url: str) -> str:
+    # Search URLs carry the admin token; this is the form that gets stored
+    # or handed out
+    return re.sub(r'&X-Plex-Token=[^&]*', '', url)
+
+
+def journal_path(songs: list, playlist_name: str) -> str:
+    digest = hashlib.sha1('\n'.join([playlist_name] + songs).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(JOURNAL_DIR, f"{digest}.jsonl")
+
+
+class RunJournal:
+    # Append-only log of one run, keyed by the song list and playlist name,
+    # with one JSON object per line. A rerun with the same input replays it:
+    # resolved songs aren't looked up again, the playlist isn't created twice
+    # and tracks already added are skipped. The file is removed once every
+    # track is in the playlist. Search URLs are stored without the token,
+    # and the file is only readable by us anyway. When one playlist goes to
+    # several accounts, each account's playlist and added tracks are kept
+    # apart (see AccountJournal).
+    def __init__(self, songs: list, playlist_name: str):
+        self.path = journal_path(songs, playlist_name)
+        self.resolved = {}  # line number -> result
+        self.playlist_ratingKey = None
+        self.committed = {}  # uri prefix -> positions already added
+        self.accounts = {}  # account -> {'ratingKey', 'committed', 'finished'}
+        self.lock = threading.Lock()
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        if os.path.exists(self.path):
+            self.replay()
+        self.file = os.fdopen(os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600), 'a', encoding='utf-8')
+        if self.file.tell() and not self.ends_with_newline():
+            self.file.write('\n')  # a crash can leave half a line behind
+
+    def ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as journal_file:
+            journal_file.seek(-1, os.SEEK_END)
+            return journal_file.read(1) == b'\n'
+
+    def replay(self):
+        with open(self.path, 'r', encoding='utf-8') as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry['event'] == 'resolved':
+                    match = entry.get('match')
+                    if entry['source'] == 'local':
+                        match = IndexedTrack(match['ratingKey'], match['artist'], match['title'])
+                    self.resolved[entry['line']] = {
+                        'artist': entry['artist'],
+                        'track': entry['track'],
+                        'source': entry['source'],
+                        'match': match,
+                        'tidal_url': f"{entry['tidal_url']}&X-Plex-Token={PLEX_TOKEN}" if entry['tidal_url'] else ''
+                    }
+                elif 'account' in entry:
+                    state = self.account_state(entry['account'])
+                    if entry['event'] == 'created':
+                        state['ratingKey'] = entry['ratingKey']
+                    elif entry['event'] == 'added':
+                        state['committed'].setdefault(entry['uri'], set()).update(entry['positions'])
+                    elif entry['event'] == 'finished':
+                        state['finished'] = True
+                elif entry['event'] == 'created':
+                    self.playlist_ratingKey = entry['ratingKey']
+                elif entry['event'] == 'added':
+                    self.committed.setdefault(entry['uri'], set()).update(entry['positions'])
+
+    def account_state(self, account: str) -> dict:
+        return self.accounts.setdefault(account, {'ratingKey': None, 'committed': {}, 'finished': False})
+
+    def record(self, entry: dict):
+        # Accounts are published from several threads at once
+        with self.lock:
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+
+    def record_result(self, line: int, result: dict):
+        match = result['match']
+        if result['source'] == 'local':
+            match = {'ratingKey': match.ratingKey, 'artist': getattr(match, 'grandparentTitle', None) or getattr(match, 'artist', ''), 'title': match.title}
+        self.record({
+            'event': 'resolved',
+            'line': line,
+            'artist': result['artist'],
+            'track': result['track'],
+            'source': result['source'],
+            'match': match,
+            'tidal_url': redact_token(result['tidal_url'])
+        })
+
+    def finish(self):
+        self.file.close()
+        os.remove(self.path)
+
+
+class AccountJournal:
+    # One account's part of a RunJournal in a multi-account run. It looks
+    # like a RunJournal to publish_playlist, but its entries are tagged with
+    # the account and finish() only marks this account's playlist complete;
+    # the RunJournal is removed once every account is done.
+    def __init__(self, journal: RunJournal, account: str):
+        self.journal = journal
+        self.account = account
+        state = journal.account_state(account)
+        self.playlist_ratingKey = state['ratingKey']
+        self.committed = state['committed']
+        self.finished = state['finished']
+
+    def record(self, entry: dict):
+        self.journal.record({**entry, 'account': self.account})
+
+    def finish(self):
+        self.record({'event': 'finished'})
+        self.finished = True
+
+
+def resolve_songs(music_library, songs: list, journal: RunJournal = None) -> list:
+    # Songs are looked up RESOLVE_WORKERS at a time. Log blocks are written
+    # whole as each one finishes, while the returned list keeps file order.
+    # Songs already in the journal are reused, and new results are added to it.
+    unknown_resolvers = [source for source in RESOLVER_ORDER if source not in RESOLVERS]
+    if unknown_resolvers:
+        print(f"{Colors.RED}Error: unknown resolver(s) in RESOLVER_ORDER: {', '.join(unknown_resolvers)}{Colors.RESET}")
+        exit()
+
+    results = [None] * len(songs)
+    if journal:
+        for line, result in journal.resolved.items():
+            results[line] = result
+    already_resolved = len(songs) - results.count(None)
+    with ThreadPoolExecutor(max_workers=RESOLVE_WORKERS) as executor, tqdm(total=len(songs), initial=already_resolved, desc="Processing songs") as pbar:
+        futures = {executor.submit(resolve_song, music_library, song_name): i for i, song_name in enumerate(songs) if results[i] is None}
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            if journal:
+                journal.record_result(futures[future], result)
+            tqdm.write(format_resolution_message(result))
+            pbar.update(1)
+    return results
+
 from plexapi.myplex import MyPlexAccount
 
-def main():
-    plex = PlexServer(PLEX_URL, PLEX_TOKEN)
-    admin_username = ADMIN_NAME
-    admin_password = ADMIN_PASS
-    user_account = input("Enter the account to add the playlist to: ")
-    
-    FILENAME = input("Input filename (or Enter for 'playlist.txt'): ").strip()
-    if not FILENAME:
-        FILENAME = 'playlist.txt'
-    
+
+def library_signature(music_library) -> tuple:
+    # (track count, newest updatedAt) in one small request; if neither has
+    # moved, the library hasn't changed
+    page = music_library._server.query(f"/library/sections/{music_library.key}/all?sort=updatedAt:desc", params={
+        'type': 10,
+        'X-Plex-Container-Start': 0,
+        'X-Plex-Container-Size': 1,
+    })
+    track = page.find('Track')
+    return page.get('totalSize') or page.get('size'), track.get('updatedAt') if track is not None else None
+
+
+def load_music_library(plex: PlexServer):
     music_library = get_music_library(plex, SECTION_TITLE)
-    songs = read_songs_from_file(FILENAME)
-    
-    existing_playlists = [playlist.title for playlist in plex.playlists()]
-    playlist_name = input("Please enter the name for the new playlist: ")
-    
-    while playlist_name in existing_playlists:
-        print(f"Playlist '{playlist_name}' already exists. Please choose a different name.")
-        playlist_name = input("Please enter the name for the new playlist: ")
-    
+    if USE_LIBRARY_INDEX:
+        print(f"{Colors.BLUE}Indexing library '{SECTION_TITLE}'...{Colors.RESET}")
+        music_library = build_library_index(music_library)
+        print(f"{Colors.BLUE}Indexed {len(music_library)} tracks.{Colors.RESET}")
+    return music_library
+
+
+def song_key(song_name: str) -> tuple:
+    artist, title = song_name.split(' - ', 1)
+    return simplify_string(artist), simplify_string(title)
+
+
+def load_user_tokens() -> dict:
+    # "machineIdentifier/account" -> {'token', 'expires'}, minus expired ones
+    if not USER_TOKEN_CACHE_FILE:
+        return {}
+    try:
+        with open(USER_TOKEN_CACHE_FILE, 'r', encoding='utf-8') as cache_file:
+            tokens = json.load(cache_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    now = time.time()
+    return {key: entry for key, entry in tokens.items() if entry.get('expires', 0) > now}
+
+
+def save_user_tokens(tokens: dict):
+    if not USER_TOKEN_CACHE_FILE:
+        return
+    # Only readable by us, since these tokens give access to the server
+    with os.fdopen(os.open(USER_TOKEN_CACHE_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as cache_file:
+        json.dump(tokens, cache_file)
+
+
+def fetch_user_tokens(machine_identifier: str, user_accounts: list, admin_account: MyPlexAccount = None) -> dict:
+    # Logs in once and fetches the user list and the server's shares side by
+    # side. The shares list holds every user's token for this server, so
+    # it's one request however many accounts there are.
+    if admin_account is None:
+        admin_account = MyPlexAccount(ADMIN_NAME, ADMIN_PASS, session=http_session)  # Authenticate with MyPlexAccount
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        users = executor.submit(admin_account.users)
+        shares = executor.submit(admin_account.query, admin_account.FRIENDINVITE.format(machineId=machine_identifier))
+        users, shares = users.result(), shares.result()
+    share_tokens = {share.get('userID'): share.get('accessToken') for share in shares}
+
+    tokens = {}
+    for user_account in user_accounts:
+        # Same matching as MyPlexAccount.user(): title, username, email or id
+        name = user_account.lower()
+        user = next((user for user in users if name in (user.title.lower(), (user.username or '').lower(), (user.email or '').lower(), str(user.id))), None)
+        tokens[user_account] = share_tokens.get(str(user.id)) if user else None
+    return tokens
+
+
+def get_user_tokens(plex: PlexServer, user_accounts: list, admin_account: MyPlexAccount = None) -> dict:
+    # account -> token on this server, or None (with an error printed) if
+    # there's no such user. Cached tokens are used until they expire, so
+    # plex.tv is only asked about the accounts it hasn't told us about yet.
+    cache = load_user_tokens()
+    tokens = {}
+    missing = []
+    for user_account in user_accounts:
+        cache_key = f"{plex.machineIdentifier}/{user_account.lower()}"
+        if user_account.lower() == ADMIN_NAME:
+            tokens[user_account] = PLEX_TOKEN
+        elif cache_key in cache:
+            tokens[user_account] = cache[cache_key]['token']
+        else:
+            missing.append(user_account)
+    metrics.cache('user token', not missing)
+    if missing:
+        for user_account, token in fetch_user_tokens(plex.machineIdentifier, missing, admin_account).items():
+            if token is None:
+                print(f"Error: Unable to find user {user_account}")
+            else:
+                cache[f"{plex.machineIdentifier}/{user_account.lower()}"] = {'token': token, 'expires': time.time() + USER_TOKEN_TTL}
+            tokens[user_account] = token
+        save_user_tokens(cache)
+    return tokens
+
+
+def get_user_server(plex: PlexServer, user_account: str, admin_account: MyPlexAccount = None):
+    # Returns (PlexServer, token) acting as user_account, or (None, None) if
+    # there's no such user. Pass a signed-in admin account to reuse it.
+    user_token = get_user_tokens(plex, [user_account], admin_account)[user_account]
+    if user_token is None:
+        return None, None
+    if user_token == PLEX_TOKEN:
+        return plex, PLEX_TOKEN
+    return PlexServer(PLEX_URL, user_token, session=http_session), user_token
+
+
+def fetch_existing_playlists(plex_token: str) -> dict:
+    # title -> ratingKey of the account's audio playlists
+    response = http_session.get(f"{PLEX_URL}/playlists", params={'playlistType': 'audio'}, headers={'X-Plex-Token': plex_token})
+    response.raise_for_status()
+    return {playlist.get('title'): playlist.get('ratingKey') for playlist in ET.fromstring(response.text).findall('Playlist')}
+
+
+def split_results(results: list):
     local_items = []
     tidal_ids = []
     not_found_tracks = []
-    log_messages = []
-    pbar = tqdm(total=len(songs), desc="Processing songs")
-    
-    if user_account.lower() != ADMIN_NAME:
-        account = MyPlexAccount(admin_username, admin_password)  # Authenticate with MyPlexAccount
-        
-        try:
-            user = account.user(user_account)  # Try to get non-admin user
-            user_token = user.get_token(plex.machineIdentifier)
-            plex = PlexServer(PLEX_URL, user_token)  # reinitialize plex with user’s token
-        except NotFound:  # Catch the NotFound exception if user is not found
-            print(f"Error: Unable to find user {user_account}")
-            exit()
-    
-    for song_name in songs:
-        artist, title = song_name.split(' - ', 1)
-        log_message = f"{Colors.YELLOW}------------------------------{Colors.RESET}\n{Colors.BLUE}Processing {artist} - {title}{Colors.RESET}\n"
-
-        local_track = find_track_in_library(music_library, artist, title)
-        tidal_id, final_url = search_tidal(PLEX_TOKEN, artist, title)
-        
-        if local_track:
-            log_message += f"{Colors.GREEN}Found in local library: {local_track.title}{Colors.RESET}\n\n"
-            local_items.append(local_track)
-        elif tidal_id:
-            tidal_ids.append(tidal_id)
-            log_message += f"{Colors.CYAN}Found on Tidal: {tidal_id}{Colors.RESET}\n\n"
+    for result in results:
+        if result['source'] == 'local':
+            local_items.append(result['match'])
+        elif result['source'] == 'tidal':
+            tidal_ids.append(result['match'])
         else:
             not_found_tracks.append({
-                'artist': artist,
-                'track': title,
-                'tidal_url': final_url
+                'artist': result['artist'],
+                'track': result['track'],
+                'tidal_url': result['tidal_url']
             })
-            log_message += f"{Colors.RED}Not found on Tidal or local: {artist} - {title}{Colors.RESET}\n{final_url}\n"
+    return local_items, tidal_ids, not_found_tracks
 
-        formatted_message = format_log_message(log_message, total_lines=4)
-        tqdm.write(formatted_message)
-        pbar.update(1)
 
-    pbar.close()
+def print_playlist_report(playlist_name: str, local_count: int, tidal_count: int, not_found_tracks: list, request_count: int, changes: dict = None):
+    # changes is what sync_playlist returns, when an existing playlist was updated
+    if not tidal_count:
+        print(Colors.YELLOW + "No Tidal tracks to add." + Colors.RESET)
 
 
-    
+    if not_found_tracks:
+        print(f"{Colors.BLUE}-" * 30)
+        print(f"{Colors.BLUE}-" * 30)
+        print(f"\nTracks not found in local library or Tidal:\n")
+        for track in not_found_tracks:
+            print(f"{Colors.CYAN}{track['artist']} - {track['track']}{Colors.RESET}")
+            print(f"{Colors.RED}Tidal: {track['tidal_url']}\n{Colors.RESET}")
+        print(f"{Colors.BLUE}-" * 30)
+        print(f"{Colors.BLUE}-" * 30)
+        
+    # Summary output
+    print(f"\n")
+    print(f"{Colors.YELLOW}-" * 30)  # Separator line for visual clarity
+    print(f"{Colors.YELLOW}-" * 30)  # Separator line for visual clarity
+    print(f"{Colors.MAGENTA}Playlist {'Sync' if changes else 'Creation'} Summary:{Colors.RESET}")
+    print(f"{Colors.CYAN}Playlist Name: {playlist_name}{Colors.RESET}")
+    if changes:
+        print(f"{Colors.GREEN}Local Tracks: {local_count}{Colors.RESET}")
+        print(f"{Colors.BLUE}Tidal Tracks: {tidal_count}{Colors.RESET}")
+        print(f"{Colors.GREEN}Tracks Added: {changes['added']}, Removed: {changes['removed']}, Moved: {changes['moved']}{Colors.RESET}")
+    else:
+        print(f"{Colors.GREEN}Local Tracks Added: {local_count}{Colors.RESET}")
+        print(f"{Colors.BLUE}Tidal Tracks Added: {tidal_count}{Colors.RESET}")
+    print(f"{Colors.RED}Total Batches Processed: {request_count}{Colors.RESET}")
+    if metrics.enabled:
+        print(f"{Colors.MAGENTA}Profile:{Colors.RESET}")
+        for line in metrics.summary_lines():
+            print(f"{Colors.CYAN}{line}{Colors.RESET}")
+    print(f"{Colors.YELLOW}-" * 30)
+    print(f"{Colors.YELLOW}-" * 30)  # Separator line for visual clarity
+    if changes:
+        print(f"{Colors.GREEN}The playlist has been updated to match the list.{Colors.RESET}")
+    else:
+        print(f"{Colors.GREEN}The playlist has been created and tracks have been added successfully.{Colors.RESET}")
+
+
+def create_and_report(plex: PlexServer, plex_token: str, playlist_name: str, results: list, journal: RunJournal = None, playlist_ratingKey: str = None):
+    # With the ratingKey of an existing playlist, that playlist is synced instead
+    local_items, tidal_ids, not_found_tracks = split_results(results)
     try:
-        if local_items:
-            local_playlist = plex.createPlaylist(playlist_name, items=local_items)
+        changes = None
+        if not local_items and not tidal_ids:
+            print(f"{Colors.RED}No tracks found in local library or Tidal, so no playlist was {'updated' if playlist_ratingKey else 'created'}.{Colors.RESET}")
+            return None
+        if playlist_ratingKey:
+            with metrics.stage('playlist sync'):
+                changes = sync_playlist(PLEX_URL, plex_token, plex.machineIdentifier, playlist_ratingKey, local_items, tidal_ids)
+            request_count = changes['requests']
         else:
-            print(Colors.YELLOW + "No local tracks found. Creating a playlist with a placeholder track." + Colors.RESET)
-            placeholder_track = find_track_in_library(music_library, PLACEHOLDER_ARTIST, PLACEHOLDER_TITLE)
-            if placeholder_track:
-                local_playlist = plex.createPlaylist(playlist_name, items=[placeholder_track])
-            else:
-                print(f"{Colors.RED}Error: Placeholder track not found in local library.{Colors.RESET}")
-                return
+            with metrics.stage('playlist publish'):
+                playlist_ratingKey, request_count = publish_playlist(PLEX_URL, plex_token, plex.machineIdentifier, playlist_name, local_items, tidal_ids, journal)
+
+        print_playlist_report(playlist_name, len(local_items), len(tidal_ids), not_found_tracks, request_count, changes)
+        return playlist_ratingKey
+
+    except Exception as e:
+        print(f"{Colors.RED}Error creating the playlist or adding tracks: {e}{Colors.RESET}")
+        return None
+
+
+def publish_for_account(plex: PlexServer, user_token: str, playlist_name: str, local_items: list, tidal_ids: list, sync: bool = False, journal: AccountJournal = None) -> dict:
+    # Creates the playlist in one account, or syncs it there if it exists
+    # and sync is on. A playlist an earlier, interrupted run created (per
+    # the journal) is finished instead. Returns {'status': 'created',
+    # 'resumed', 'updated', 'exists' or 'done', 'ratingKey', 'requests',
+    # 'changes', 'complete'}.
+    if journal and journal.finished:
+        return {'status': 'done', 'ratingKey': journal.playlist_ratingKey, 'requests': 0, 'changes': None, 'complete': True}
+    existing_playlists = fetch_existing_playlists(user_token)
+    playlist_ratingKey = existing_playlists.get(playlist_name)
+    if journal and journal.playlist_ratingKey:
+        playlist_ratingKey, request_count = publish_playlist(PLEX_URL, user_token, plex.machineIdentifier, playlist_name, local_items, tidal_ids, journal)
+        return {'status': 'resumed', 'ratingKey': playlist_ratingKey, 'requests': request_count + 1, 'changes': None, 'complete': journal.finished}
+    if playlist_name in existing_playlists and not sync:
+        return {'status': 'exists', 'ratingKey': playlist_ratingKey, 'requests': 1, 'changes': None, 'complete': True}
+    if playlist_name in existing_playlists:
+        changes = sync_playlist(PLEX_URL, user_token, plex.machineIdentifier, playlist_ratingKey, local_items, tidal_ids)
+        return {'status': 'updated', 'ratingKey': playlist_ratingKey, 'requests': changes['requests'] + 1, 'changes': changes, 'complete': True}
+    playlist_ratingKey, request_count = publish_playlist(PLEX_URL, user_token, plex.machineIdentifier, playlist_name, local_items, tidal_ids, journal)
+    return {'status': 'created', 'ratingKey': playlist_ratingKey, 'requests': request_count + 1, 'changes': None, 'complete': journal.finished if journal else True}
 
-        tidal_track_count = 0
-        if tidal_ids:
-            tidal_track_count = len(tidal_ids)
-            add_track_to_playlist(PLEX_URL, PLEX_TOKEN, tidal_ids, local_playlist.ratingKey)
 
-            if not local_items and placeholder_track:  # Remove placeholder if no local tracks were initially found
-                local_playlist.removeItems([placeholder_track])  # Updated to use removeItems
+def create_for_accounts(plex: PlexServer, user_tokens: dict, playlist_name: str, results: list, journal: RunJournal = None, sync: bool = False):
+    # Publishes one resolved playlist to several accounts, PUBLISH_WORKERS at
+    # a time. Accounts that already have a playlist with this name are
+    # skipped, or with sync their playlist is updated instead. With a
+    # journal, each account's playlist from an interrupted run is finished
+    # and the journal is only removed once every account has all its tracks.
+    local_items, tidal_ids, not_found_tracks = split_results(results)
+    if not local_items and not tidal_ids:
+        print(f"{Colors.RED}No tracks found in local library or Tidal, so no playlist was created.{Colors.RESET}")
+        return
 
+    with metrics.stage('playlist publish'), ThreadPoolExecutor(max_workers=PUBLISH_WORKERS) as executor:
+        futures = {user_account: executor.submit(publish_for_account, plex, user_token, playlist_name, local_items, tidal_ids, sync, AccountJournal(journal, user_account) if journal else None)
+                   for user_account, user_token in user_tokens.items()}
+    request_count = 0
+    all_published = True
+    for user_account, future in futures.items():
+        try:
+            published = future.result()
+        except Exception as e:
+            print(f"{Colors.RED}Error creating the playlist or adding tracks for {user_account}: {e}{Colors.RESET}")
+            all_published = False
+            continue
+        request_count += published['requests']
+        all_published = all_published and published['complete']
+        if not published['complete']:
+            print(f"{Colors.YELLOW}Not every track could be added to '{playlist_name}' for {user_account}; run it again to finish.{Colors.RESET}")
+        elif published['status'] == 'done':
+            print(f"{Colors.GREEN}'{playlist_name}' for {user_account} was already finished by an earlier run.{Colors.RESET}")
+        elif published['status'] == 'resumed':
+            print(f"{Colors.GREEN}Finished '{playlist_name}' for {user_account}.{Colors.RESET}")
+        elif published['status'] == 'exists':
+            print(f"{Colors.YELLOW}{user_account} already has a playlist called '{playlist_name}', skipping.{Colors.RESET}")
+        elif published['status'] == 'updated':
+            changes = published['changes']
+            print(f"{Colors.GREEN}Updated '{playlist_name}' for {user_account}: {changes['added']} added, {changes['removed']} removed, {changes['moved']} moved.{Colors.RESET}")
         else:
-            print(Colors.YELLOW + "No Tidal tracks to add." + Colors.RESET)
-
-
-        if not_found_tracks:
-            print(f"{Colors.BLUE}-" * 30)
-            print(f"{Colors.BLUE}-" * 30)
-            print(f"\nTracks not found in local library or Tidal:\n")
-            for track in not_found_tracks:
-                print(f"{Colors.CYAN}{track['artist']} - {track['track']}{Colors.RESET}")
-                print(f"{Colors.RED}Tidal: {track['tidal_url']}\n{Colors.RESET}")
-            print(f"{Colors.BLUE}-" * 30)
-            print(f"{Colors.BLUE}-" * 30)
-            
-        # Summary output
-        print(f"\n")
-        print(f"{Colors.YELLOW}-" * 30)  # Separator line for visual clarity
-        print(f"{Colors.YELLOW}-" * 30)  # Separator line for visual clarity
-        print(f"{Colors.MAGENTA}Playlist Creation Summary:{Colors.RESET}")
-        print(f"{Colors.CYAN}Playlist Name: {playlist_name}{Colors.RESET}")
-        print(f"{Colors.GREEN}Local Tracks Added: {len(local_items)}{Colors.RESET}")
-        print(f"{Colors.BLUE}Tidal Tracks Added: {tidal_track_count}{Colors.RESET}")
-        print(f"{Colors.RED}Total Batches Processed: {len(tidal_ids) // BATCH_SIZE + (1 if len(tidal_ids) % BATCH_SIZE > 0 else 0)}{Colors.RESET}")
-        print(f"{Colors.YELLOW}-" * 30)
-        print(f"{Colors.YELLOW}-" * 30)  # Separator line for visual clarity
-        print(f"{Colors.GREEN}The playlist has been created and tracks have been added successfully.{Colors.RESET}")
+            print(f"{Colors.GREEN}Created '{playlist_name}' for {user_account}.{Colors.RESET}")
+
+    print_playlist_report(playlist_name, len(local_items), len(tidal_ids), not_found_tracks, request_count)
+    if journal and all_published:
+        journal.finish()
+
+
+def stream_songs(stream):
+    for line in stream:
+        if ' - ' in line:
+            yield line.strip()
+
+
+def iter_resolved_songs(music_library, songs):
+    # Resolves songs from an iterator of unknown length (like stdin) as they
+    # arrive and yields the results in input order. A reader thread keeps a
+    # slow producer from blocking finished lookups, with at most
+    # 2 * RESOLVE_WORKERS lines in flight. None is yielded whenever nothing
+    # happened for a moment, so the caller can still flush on a timer.
+    lines = queue.Queue(maxsize=RESOLVE_WORKERS * 2)
+
+    def read_lines():
+        for song_name in songs:
+            lines.put(song_name)
+        lines.put(None)
+
+    threading.Thread(target=read_lines, daemon=True).start()
+    pending = deque()
+    input_finished = False
+    with ThreadPoolExecutor(max_workers=RESOLVE_WORKERS) as executor:
+        while pending or not input_finished:
+            while pending and pending[0].done():
+                yield pending.popleft().result()
+            if not input_finished and len(pending) < RESOLVE_WORKERS * 2:
+                try:
+                    song_name = lines.get(timeout=STREAM_POLL_SECONDS)
+                except queue.Empty:
+                    yield None
+                    continue
+                if song_name is None:
+                    input_finished = True
+                else:
+                    pending.append(executor.submit(resolve_song, music_library, song_name))
+            elif pending:
+                wait([pending[0]], timeout=STREAM_POLL_SECONDS)
+                if not pending[0].done():
+                    yield None
+
+
+class StreamingPlaylist:
+    # Collects resolved tracks and adds them to the playlist in batches while
+    # input is still arriving. The first flush creates the playlist.
+    def __init__(self, plex_url: str, plex_token: str, machine_identifier: str, playlist_name: str):
+        self.plex_url = plex_url
+        self.plex_token = plex_token
+        self.library_uri = library_uri(machine_identifier)
+        self.playlist_name = playlist_name
+        self.playlist_ratingKey = None
+        self.pending = []  # (uri prefix, id) in playlist order
+        self.last_flush = time.monotonic()
+        self.request_count = 0
+
+    def add(self, result: dict):
+        if result['source'] == 'local':
+            self.pending.append((self.library_uri, result['match'].ratingKey))
+        elif result['source'] == 'tidal':
+            self.pending.append((PROVIDER_URI, result['match']))
+
+    def flush_due(self) -> bool:
+        if len(self.pending) >= STREAM_FLUSH_SIZE:
+            return True
+        return bool(self.pending) and time.monotonic() - self.last_flush >= STREAM_FLUSH_SECONDS
+
+    def flush(self):
+        with metrics.stage('playlist publish'):
+            self.flush_pending()
 
+    def flush_pending(self):
+        for uri_prefix, group in groupby(self.pending, key=lambda item: item[0]):
+            ids = [item_id for _, item_id in group]
+            if self.playlist_ratingKey is None:
+                self.playlist_ratingKey, ids = create_playlist(self.plex_url, self.plex_token, self.playlist_name, uri_prefix, ids)
+                self.request_count += 1
+            if ids:
+                self.request_count += add_track_to_playlist(self.plex_url, self.plex_token, ids, self.playlist_ratingKey, uri_prefix)
+        self.pending = []
+        self.last_flush = time.monotonic()
+
+
+def run_stream(playlist_name: str, user_account: str, stream):
+    # Reads ARTIST - TRACK lines from a pipe and builds the playlist as they
+    # come in, keeping only counts and the not-found list in memory.
+    plex = initialize_plex_server(PLEX_URL, PLEX_TOKEN)
+    music_library = load_music_library(plex)
+    plex, plex_token = get_user_server(plex, user_account)
+    if plex is None:
+        exit()
+    if playlist_name in [playlist.title for playlist in plex.playlists()]:
+        print(f"{Colors.RED}Playlist '{playlist_name}' already exists. Please choose a different name.{Colors.RESET}")
+        exit()
+
+    playlist = StreamingPlaylist(PLEX_URL, plex_token, plex.machineIdentifier, playlist_name)
+    local_count = tidal_count = 0
+    not_found_tracks = []
+    try:
+        with tqdm(desc="Processing songs") as pbar:
+            for result in iter_resolved_songs(music_library, stream_songs(stream)):
+                if result is not None:
+                    tqdm.write(format_resolution_message(result))
+                    pbar.update(1)
+                    playlist.add(result)
+                    if result['source'] == 'local':
+                        local_count += 1
+                    elif result['source'] == 'tidal':
+                        tidal_count += 1
+                    else:
+                        not_found_tracks.append({
+                            'artist': result['artist'],
+                            'track': result['track'],
+                            'tidal_url': result['tidal_url']
+                        })
+                if playlist.flush_due():
+                    playlist.flush()
+        playlist.flush()
     except Exception as e:
         print(f"{Colors.RED}Error creating the playlist or adding tracks: {e}{Colors.RESET}")
+        return
+
+    if playlist.playlist_ratingKey is None:
+        print(f"{Colors.RED}No tracks found in local library or Tidal, so no playlist was created.{Colors.RESET}")
+        return
+    print_playlist_report(playlist_name, local_count, tidal_count, not_found_tracks, playlist.request_count)
+
+
+def read_batch_jobs(batch_path: str) -> list:
+    # A directory makes one playlist per .txt file, named after the file, in
+    # the admin account. A JSON manifest lists {"file", "name", "account"}
+    # entries, with file paths relative to the manifest.
+    if os.path.isdir(batch_path):
+        jobs = [
+            {'file': os.path.join(batch_path, filename), 'name': os.path.splitext(filename)[0], 'account': ADMIN_NAME}
+            for filename in sorted(os.listdir(batch_path)) if filename.endswith('.txt')
+        ]
+    else:
+        try:
+            with open(batch_path, 'r', encoding='utf-8') as manifest:
+                entries = json.load(manifest)
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            print(f"{Colors.RED}Error reading batch manifest '{batch_path}': {e}{Colors.RESET}")
+            exit()
+        manifest_dir = os.path.dirname(batch_path)
+        jobs = [
+            {
+                'file': os.path.join(manifest_dir, entry['file']),
+                'name': entry.get('name') or os.path.splitext(os.path.basename(entry['file']))[0],
+                'account': entry.get('account') or ADMIN_NAME
+            }
+            for entry in entries
+        ]
+    for job in jobs:
+        job['songs'] = read_songs_from_file(job['file'])
+    return jobs
+
+
+def run_batch(batch_path: str, sync: bool = False):
+    # Builds every playlist in the batch in one process. The library index,
+    # match memo, search cache and user logins are shared, and a song that
+    # appears in several files is only resolved once.
+    jobs = read_batch_jobs(batch_path)
+    plex = initialize_plex_server(PLEX_URL, PLEX_TOKEN)
+    music_library = load_music_library(plex)
+
+    unique_songs = {}
+    for job in jobs:
+        for song_name in job['songs']:
+            unique_songs.setdefault(song_key(song_name), song_name)
+    total_lines = sum(len(job['songs']) for job in jobs)
+    print(f"{Colors.BLUE}{len(jobs)} playlists, {total_lines} lines, {len(unique_songs)} unique songs.{Colors.RESET}")
+
+    match_songs_in_library(music_library, list(unique_songs.values()))
+    resolved = dict(zip(unique_songs, resolve_songs(music_library, list(unique_songs.values()))))
+
+    user_tokens = get_user_tokens(plex, list(dict.fromkeys(job['account'] for job in jobs)))
+    existing_playlists = {}
+    for job in jobs:
+        user_account = job['account']
+        user_token = user_tokens[user_account]
+        if user_token is None:
+            continue
+        if user_account not in existing_playlists:
+            existing_playlists[user_account] = fetch_existing_playlists(user_token)
+        playlist_ratingKey = existing_playlists[user_account].get(job['name'])
+        if job['name'] in existing_playlists[user_account] and not sync:
+            print(f"{Colors.RED}Playlist '{job['name']}' already exists for {user_account}, skipping {job['file']}.{Colors.RESET}")
+            continue
+
+        print(f"{Colors.MAGENTA}{'Updating' if playlist_ratingKey else 'Creating'} '{job['name']}' for {user_account}{Colors.RESET}")
+        existing_playlists[user_account][job['name']] = create_and_report(plex, user_token, job['name'], [resolved[song_key(song_name)] for song_name in job['songs']], playlist_ratingKey=playlist_ratingKey)
+
+
+class PlaylistService:
+    # What --serve keeps between jobs: the server connection, the library
+    # index and its match memo, plus the search and user token caches that
+    # live at module level anyway. Jobs run one at a time in submission
+    # order, and a watcher thread swaps in a fresh index when the library
+    # changes; a running job keeps the index it started with.
+    def __init__(self):
+        self.plex = initialize_plex_server(PLEX_URL, PLEX_TOKEN)
+        self.section = get_music_library(self.plex, SECTION_TITLE)
+        # Signature first, so a change made while indexing is still noticed
+        self.signature = library_signature(self.section) if USE_LIBRARY_INDEX else None
+        self.music_library = build_library_index(self.section) if USE_LIBRARY_INDEX else self.section
+        self.user_tokens = {}  # account -> (token, expires)
+        self.jobs = {}
+        self.jobs_lock = threading.Lock()
+        self.job_ids = count(1)
+        self.runner = ThreadPoolExecutor(max_workers=1)
+        if USE_LIBRARY_INDEX:
+            threading.Thread(target=self.watch_library, daemon=True).start()
 
+    def watch_library(self):
+        while True:
+            time.sleep(DAEMON_REFRESH_SECONDS)
+            try:
+                signature = library_signature(self.section)
+                if signature == self.signature:
+                    continue
+                music_library = build_library_index(self.section)
+                self.music_library, self.signature = music_library, signature
+                print(f"{Colors.BLUE}Library changed, re-indexed {len(music_library)} tracks.{Colors.RESET}")
+            except Exception as e:
+                print(f"{Colors.RED}Error checking the library for changes: {e}{Colors.RESET}")
+
+    def submit(self, request: dict) -> dict:
+        # request: {"songs": text or list of lines, "name", "account" or
+        # "accounts", "sync"}. Raises ValueError for a bad request.
+        songs = request.get('songs') or []
+        if isinstance(songs, str):
+            songs = songs.splitlines()
+        songs = [line.strip() for line in songs if ' - ' in line]
+        name = (request.get('name') or '').strip()
+        accounts = request.get('accounts') or [request.get('account') or ADMIN_NAME]
+        if isinstance(accounts, str):
+            accounts = [account.strip() for account in accounts.split(',') if account.strip()]
+        if not songs:
+            raise ValueError("no ARTIST - TRACK lines in 'songs'")
+        if not name:
+            raise ValueError("'name' is required")
+
+        job = {
+            'id': str(next(self.job_ids)),
+            'name': name,
+            'accounts': accounts,
+            'sync': bool(request.get('sync')),
+            'state': 'queued',
+            'total': len(songs),
+            'resolved': 0,
+            'local': 0,
+            'tidal': 0,
+            'not_found': [],
+            'playlists': {},
+            'error': None,
+            'seconds': None,
+        }
+        with self.jobs_lock:
+            self.jobs[job['id']] = job
+            finished = [job_id for job_id, other in self.jobs.items() if other['state'] in ('done', 'failed')]
+            for job_id in finished[:max(len(finished) - DAEMON_JOBS_KEPT, 0)]:
+                del self.jobs[job_id]
+        self.runner.submit(self.run_job, job, songs)
+        return self.job(job['id'])
+
+    def tokens_for(self, user_accounts: list) -> dict:
+        # get_user_tokens, minus even the cache file read for accounts
+        # already seen; only the job runner thread calls this
+        now = time.time()
+        missing = [user_account for user_account in user_accounts if self.user_tokens.get(user_account, (None, 0))[1] <= now]
+        if missing:
+            for user_account, user_token in get_user_tokens(self.plex, missing).items():
+                if user_token:
+                    self.user_tokens[user_account] = (user_token, now + USER_TOKEN_TTL)
+        return {user_account: self.user_tokens.get(user_account, (None, 0))[0] for user_account in user_accounts}
+
+    def job(self, job_id: str):
+        with self.jobs_lock:
+            job = self.jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job else None
+
+    def run_job(self, job: dict, songs: list):
+        start = time.perf_counter()
+        with self.jobs_lock:
+            job['state'] = 'running'
+        try:
+            music_library = self.music_library
+            match_songs_in_library(music_library, songs)
+            results = [None] * len(songs)
+            with ThreadPoolExecutor(max_workers=RESOLVE_WORKERS) as executor:
+                futures = {executor.submit(resolve_song, music_library, song_name): i for i, song_name in enumerate(songs)}
+                for future in as_completed(futures):
+                    result = future.result()
+                    results[futures[future]] = result
+                    with self.jobs_lock:
+                        job['resolved'] += 1
+                        if result['source'] in ('local', 'tidal'):
+                            job[result['source']] += 1
+            local_items, tidal_ids, not_found_tracks = split_results(results)
+            with self.jobs_lock:
+                job['not_found'] = [{**track, 'tidal_url': redact_token(track['tidal_url'])} for track in not_found_tracks]
+
+            if local_items or tidal_ids:
+                user_tokens = self.tokens_for(job['accounts'])
+                for user_account, user_token in user_tokens.items():
+                    if user_token is None:
+                        published = {'status': 'unknown account'}
+                    else:
+                        with metrics.stage('playlist publish'):
+                            published = publish_for_account(self.plex, user_token, job['name'], local_items, tidal_ids, job['sync'])
+                    with self.jobs_lock:
+                        job['playlists'][user_account] = published
+            with self.jobs_lock:
+                job['state'] = 'done'
+        except Exception as e:
+            with self.jobs_lock:
+                job['state'], job['error'] = 'failed', str(e)
+        with self.jobs_lock:
+            job['seconds'] = round(time.perf_counter() - start, 3)
+        print(f"{Colors.MAGENTA}Job {job['id']} '{job['name']}': {job['state']} in {job['seconds']}s ({job['local']} local, {job['tidal']} Tidal, {len(job['not_found'])} not found){Colors.RESET}")
+
+
+def daemon_secret() -> str:
+    # Created on first use, only readable by us, like the user token cache
+    try:
+        with open(DAEMON_SECRET_FILE, 'r', encoding='utf-8') as secret_file:
+            secret = secret_file.read().strip()
+        if secret:
+            return secret
+    except FileNotFoundError:
+        pass
+    secret = secrets.token_urlsafe(32)
+    with os.fdopen(os.open(DAEMON_SECRET_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as secret_file:
+        secret_file.write(secret)
+    return secret
+
+
+def run_service():
+    # A small JSON API on DAEMON_HOST:DAEMON_PORT:
+    #   POST /jobs       submit a job, answers with the job (202)
+    #   GET  /jobs/<id>  progress, not-found list and playlists of a job
+    #   GET  /jobs       every job that's still remembered
+    #   GET  /status     library size and job count
+    # Every request needs "Authorization: Bearer <secret from
+    # DAEMON_SECRET_FILE>" and a Host header naming this address, so other
+    # users on the machine and web pages (DNS rebinding included) can't use
+    # it. Job bodies must be sent as application/json.
+    secret = daemon_secret()
+    allowed_host = f"{DAEMON_HOST}:{DAEMON_PORT}"
+    service = PlaylistService()
+
+    class Handler(BaseHTTPRequestHandler):
+        def allowed(self) -> bool:
+            if self.headers.get('Host') != allowed_host:
+                self.send_json(403, {'error': 'unexpected Host header'})
+                return False
+            if not hmac.compare_digest(self.headers.get('Authorization', ''), f"Bearer {secret}"):
+                self.send_json(401, {'error': f"missing or wrong secret (see {DAEMON_SECRET_FILE})"})
+                return False
+            return True
+
+        def send_json(self, status: int, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if not self.allowed():
+                return
+            path = urlsplit(self.path).path.rstrip('/')
+            if path == '/status':
+                with service.jobs_lock:
+                    job_count = len(service.jobs)
+                self.send_json(200, {'tracks': len(service.music_library) if USE_LIBRARY_INDEX else None, 'jobs': job_count})
+            elif path == '/jobs':
+                with service.jobs_lock:
+                    job_ids = list(service.jobs)
+                self.send_json(200, [service.job(job_id) for job_id in job_ids])
+            elif path.startswith('/jobs/') and service.job(path[len('/jobs/'):]):
+                self.send_json(200, service.job(path[len('/jobs/'):]))
+            else:
+                self.send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if not self.allowed():
+                return
+            if urlsplit(self.path).path.rstrip('/') != '/jobs':
+                self.send_json(404, {'error': 'not found'})
+                return
+            if self.headers.get_content_type() != 'application/json':
+                self.send_json(415, {'error': 'expected application/json'})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+                if not isinstance(request, dict):
+                    raise ValueError("expected a JSON object")
+                self.send_json(202, service.submit(request))
+            except ValueError as e:  # json.JSONDecodeError is a ValueError too
+                self.send_json(400, {'error': str(e)})
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((DAEMON_HOST, DAEMON_PORT), Handler)
+    print(f"{Colors.GREEN}Listening on http://{DAEMON_HOST}:{DAEMON_PORT}, Ctrl+C to stop.{Colors.RESET}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+def main(sync: bool = False):
+    plex = PlexServer(PLEX_URL, PLEX_TOKEN, session=http_session)
+    # Several accounts can be given, separated by commas
+    user_accounts = [account.strip() for account in input("Enter the account(s) to add the playlist to: ").split(',') if account.strip()]
+    
+    FILENAME = input("Input filename (or Enter for 'playlist.txt'): ").strip()
+    if not FILENAME:
+        FILENAME = 'playlist.txt'
+    
+    songs = read_songs_from_file(FILENAME)
+    
+    existing_playlists = [playlist.title for playlist in plex.playlists()]
+    playlist_name = input("Please enter the name for the new playlist: ")
+    
+    # An existing name is fine if it belongs to an unfinished run of this same
+    # list, or when syncing
+    while playlist_name in existing_playlists and not sync and not (JOURNAL_DIR and os.path.exists(journal_path(songs, playlist_name))):
+        print(f"Playlist '{playlist_name}' already exists. Please choose a different name.")
+        playlist_name = input("Please enter the name for the new playlist: ")
+    
+    # Everything below runs without waiting on the user, so that's what the
+    # 'total' stage times
+    with metrics.stage('total'):
+        music_library = load_music_library(plex)
+        user_tokens = {user_account: user_token for user_account, user_token in get_user_tokens(plex, user_accounts).items() if user_token}
+        if not user_tokens:
+            exit()
+
+        # A sync is cheap to redo, so it doesn't keep a journal
+        journal = RunJournal(songs, playlist_name) if JOURNAL_DIR and not sync else None
+        if journal and (journal.resolved or journal.playlist_ratingKey or journal.accounts):
+            print(f"{Colors.YELLOW}Resuming an unfinished run: {len(journal.resolved)} of {len(songs)} songs already resolved.{Colors.RESET}")
+
+        match_songs_in_library(music_library, songs)
+        results = resolve_songs(music_library, songs, journal)
+        if len(user_tokens) == 1:
+            user_token = next(iter(user_tokens.values()))
+            playlist_ratingKey = fetch_existing_playlists(user_token).get(playlist_name) if sync else None
+            create_and_report(plex, user_token, playlist_name, results, journal, playlist_ratingKey)
+        else:
+            create_for_accounts(plex, user_tokens, playlist_name, results, journal, sync)
 
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Build Plex playlists from ARTIST - TRACK text files.")
+    parser.add_argument('--batch', metavar='PATH', help="build a playlist for every .txt file in a directory, or for every entry in a JSON manifest, without prompting")
+    parser.add_argument('--stdin', action='store_true', help="read songs from standard input and add them to the playlist as they arrive (needs --name)")
+    parser.add_argument('--name', help="playlist name for --stdin")
+    parser.add_argument('--account', default=ADMIN_NAME, help="account to add the --stdin playlist to (default: the admin)")
+    parser.add_argument('--serve', action='store_true', help="keep running as a local service with the library loaded, taking jobs from plex-playlist-client.py")
+    parser.add_argument('--sync', action='store_true', help="update a playlist that already exists to match the list, instead of asking for a new name (or skipping it in --batch)")
+    parser.add_argument('--profile', action='store_true', help="time each stage and HTTP endpoint and print it with the summary")
+    parser.add_argument('--metrics', metavar='FILE', help="like --profile, and also write the numbers to FILE (Prometheus text if it ends in .prom, JSON otherwise)")
+    args = parser.parse_args()
+    if args.stdin and not args.name:
+        parser.error("--stdin needs --name, since the prompts can't read from a pipe")
+    metrics.enabled = args.profile or bool(args.metrics)
+    try:
+        if args.serve or args.batch or args.stdin:
+            with metrics.stage('total'):
+                if args.serve:
+                    run_service()
+                elif args.batch:
+                    run_batch(args.batch, args.sync)
+                else:
+                    run_stream(args.name, args.account, sys.stdin)
+        else:
+            main(args.sync)  # times 'total' itself, leaving out the prompts
+    finally:
+        if args.metrics:
+            metrics.write(args.metrics)
@@ -0,0 +1,110 @@
+# Sends a playlist to the script running with --serve and waits for it to
+# be built. This file only uses the standard library, so it starts in a
+# blink; the service already has the library loaded.
+#
+#   python plex-playlist-client.py playlist.txt --name "Late Night" --account kim
+#
+# Use - as the file to read the songs from standard input.
+
+import argparse
+import functools
+import json
+import sys
+import time
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from ppg_config import DAEMON_HOST, DAEMON_PORT, DAEMON_SECRET_FILE, ADMIN_NAME
+
+
+class Colors:
+    RED = '\033[91m'
+    GREEN = '\033[92m'
+    YELLOW = '\033[93m'
+    BLUE = '\033[94m'
+    CYAN = '\033[96m'
+    RESET = '\033[0m'
+
+
+SERVICE_URL = f"http://{DAEMON_HOST}:{DAEMON_PORT}"
+
+
+@functools.lru_cache(maxsize=None)
+def read_secret() -> str:
+    # Written by the service the first time it starts
+    try:
+        with open(DAEMON_SECRET_FILE, 'r', encoding='utf-8') as secret_file:
+            return secret_file.read().strip()
+    except FileNotFoundError:
+        print(f"{Colors.RED}Error: '{DAEMON_SECRET_FILE}' not found. Start the service with --serve first.{Colors.RESET}")
+        exit(1)
+
+
+def call(method: str, path: str, body: dict = None) -> dict:
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    headers = {'Content-Type': 'application/json', 'Authorization': f"Bearer {read_secret()}"}
+    request = Request(SERVICE_URL + path, data=data, method=method, headers=headers)
+    try:
+        with urlopen(request, timeout=30) as response:
+            return json.load(response)
+    except HTTPError as e:
+        print(f"{Colors.RED}Error: {json.load(e).get('error', e.reason)}{Colors.RESET}")
+        exit(1)
+    except URLError as e:
+        print(f"{Colors.RED}Error: can't reach the service at {SERVICE_URL} ({e.reason}). Start it with --serve.{Colors.RESET}")
+        exit(1)
+
+
+def print_job(job: dict):
+    if job['not_found']:
+        print(f"\nTracks not found in local library or Tidal:\n")
+        for track in job['not_found']:
+            print(f"{Colors.CYAN}{track['artist']} - {track['track']}{Colors.RESET}")
+            print(f"{Colors.RED}Tidal: {track['tidal_url']}\n{Colors.RESET}")
+    print(f"{Colors.GREEN}Local Tracks: {job['local']}{Colors.RESET}")
+    print(f"{Colors.BLUE}Tidal Tracks: {job['tidal']}{Colors.RESET}")
+    for account, published in job['playlists'].items():
+        if published['status'] == 'updated':
+            changes = published['changes']
+            print(f"{Colors.GREEN}Updated '{job['name']}' for {account}: {changes['added']} added, {changes['removed']} removed, {changes['moved']} moved.{Colors.RESET}")
+        elif published['status'] == 'created':
+            print(f"{Colors.GREEN}Created '{job['name']}' for {account}.{Colors.RESET}")
+        elif published['status'] == 'exists':
+            print(f"{Colors.YELLOW}{account} already has a playlist called '{job['name']}' (use --sync to update it).{Colors.RESET}")
+        else:
+            print(f"{Colors.RED}Error: Unable to find user {account}{Colors.RESET}")
+    if job['state'] == 'failed':
+        print(f"{Colors.RED}Error creating the playlist or adding tracks: {job['error']}{Colors.RESET}")
+    else:
+        print(f"Done in {job['seconds']}s.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send an ARTIST - TRACK list to the playlist service.")
+    parser.add_argument('file', help="text file with one ARTIST - TRACK per line, or - for standard input")
+    parser.add_argument('--name', required=True, help="playlist name")
+    parser.add_argument('--account', default=ADMIN_NAME, help="account(s) to add the playlist to, separated by commas (default: the admin)")
+    parser.add_argument('--sync', action='store_true', help="update the playlist if it already exists")
+    parser.add_argument('--no-wait', action='store_true', help="just submit the job and print its id")
+    args = parser.parse_args()
+
+    if args.file == '-':
+        songs = sys.stdin.read()
+    else:
+        try:
+            with open(args.file, 'r', encoding='utf-8') as file:
+                songs = file.read()
+        except FileNotFoundError:
+            print(f"{Colors.RED}Error: '{args.file}' not found.{Colors.RESET}")
+            exit(1)
+
+    job = call('POST', '/jobs', {'songs': songs, 'name': args.name, 'accounts': args.account, 'sync': args.sync})
+    if args.no_wait:
+        print(job['id'])
+        exit()
+    while job['state'] in ('queued', 'running'):
+        print(f"\rProcessing songs: {job['resolved']}/{job['total']}", end='', file=sys.stderr)
+        time.sleep(0.1)
+        job = call('GET', f"/jobs/{job['id']}")
+    print(f"\rProcessing songs: {job['resolved']}/{job['total']}", file=sys.stderr)
+    print_job(job)
@@ -1,9 +1,17 @@
+import os
+
 
 # Change it to reflect the local URL of your Plex server.
 
 PLEX_URL = 'http://192.168.0.214:32400'
 
 
+# Where Tidal searches go. Only change it to point the script at a test
+# server, like the one in benchmarks/.
+
+PROVIDER_URL = 'https://music.provider.plex.tv'
+
+
 # I think the token is 20 characters
 
 PLEX_TOKEN = '[YOUR PLEX TOKEN]'
@@ -20,21 +28,187 @@ ADMIN_PASS = '[PLEX ADMIN PASSWORD]'
 FUZZ_AMT = 60
 
 
-# This splits up adding songs to the playlist in batches,
-# since the Plex URL for adding songs can't hold an infinite
-# amount of tracks.
+# Tracks are added to the playlist in as few requests as possible, with
+# as many track IDs per request as fit in a URL of this many characters.
+# Lower it if a proxy in front of your Plex server rejects long URLs.
+
+MAX_URL_LENGTH = 7500
+
+
+# Pull the whole music library once at startup into an in-memory index,
+# so every song is matched locally instead of searching the server
+# artist -> albums -> tracks for each line. Set to False to use the
+# old per-song server search.
+
+USE_LIBRARY_INDEX = True
+
+
+# How many tracks to request per page while building the library index.
+
+LIBRARY_PAGE_SIZE = 2000
+
+
+# Keep the library index in a SQLite file next to this config, so later
+# runs only fetch tracks added or changed since the last sync instead of
+# the whole library. Set to None to always index from scratch.
+
+LIBRARY_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ppg_library.sqlite')
+
+
+# The library index is also saved in this file in a compact form that is
+# read straight from disk instead of being loaded into memory, so startup
+# is instant and memory stays low even with hundreds of thousands of tracks.
+# Several runs (or --batch and --serve) at the same time share one copy.
+# It's rebuilt, from the cache above when there is one, whenever the library
+# changes. Set to None to keep the whole index in memory instead.
+
+LIBRARY_INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ppg_library.idx')
+
+
+# How many songs to look up at the same time. Each lookup mostly waits
+# on the network, so a handful of workers cuts the run time a lot.
+# Set to 1 to process the list one song at a time.
+
+RESOLVE_WORKERS = 8
+
+
+# The order in which each song is looked up. The first one that finds a
+# match wins and the rest are skipped, so with 'local' first a song you
+# already own never costs a Tidal search. Options: 'local', 'tidal'.
+
+RESOLVER_ORDER = ['local', 'tidal']
+
+
+# Tidal search responses are cached in this file so re-running a playlist,
+# or building one that overlaps an earlier one, doesn't repeat the same
+# searches. Set to None to always search live.
+
+SEARCH_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ppg_search_cache.sqlite')
+
+
+# How long cached searches are trusted, in seconds. Searches that found
+# nothing expire sooner, in case Tidal adds the track later.
+
+SEARCH_CACHE_TTL = 30 * 24 * 60 * 60
+SEARCH_CACHE_NEGATIVE_TTL = 2 * 24 * 60 * 60
+
+
+# Once the cache holds this many searches, the least recently used go first.
+
+SEARCH_CACHE_MAX_ENTRIES = 50000
+
+
+# Settings for the HTTP connection shared by every request to your Plex
+# server and to Tidal. Connections are kept open and reused.
+# HTTP_MAX_CONNECTIONS_PER_HOST caps how many are open to one host at once.
+
+HTTP_TIMEOUT = 30
+HTTP_POOL_HOSTS = 4
+HTTP_MAX_CONNECTIONS_PER_HOST = 8
+
+
+# Requests per second allowed to each host, with short bursts up to
+# HTTP_RATE_BURST. Keeps big playlists from getting throttled by Tidal.
+
+HTTP_RATE_LIMIT = 10
+HTTP_RATE_BURST = 20
+
+
+# When a request is throttled (429) or the server has an error (5xx), wait
+# and try again up to HTTP_MAX_RETRIES times. The wait roughly doubles
+# each time, starting at HTTP_BACKOFF_BASE seconds, up to HTTP_BACKOFF_MAX.
+
+HTTP_MAX_RETRIES = 4
+HTTP_BACKOFF_BASE = 0.5
+HTTP_BACKOFF_MAX = 30
+
+
+# With the optional rapidfuzz package installed (pip install rapidfuzz),
+# the whole playlist is matched against the library index in one go.
+# This is how many songs are scored together; lower it if memory is tight
+# on a very large library.
+
+MATCH_CHUNK_SIZE = 64
+
+
+# Before fuzzy matching, narrow the library down to tracks that share words
+# or 3-letter chunks with the song being looked up. Lookups then stay fast
+# as the library grows. BLOCKING_CANDIDATES is how many tracks get the full
+# fuzzy check; BLOCKING_MAX_POSTINGS caps how much of the index one lookup
+# reads. Set MATCH_BLOCKING to False to fuzzy match against everything.
+
+MATCH_BLOCKING = True
+BLOCKING_CANDIDATES = 200
+BLOCKING_MAX_POSTINGS = 20000
+
+
+# With --stdin, resolved tracks are added to the playlist as they come in:
+# whenever STREAM_FLUSH_SIZE tracks are waiting, or STREAM_FLUSH_SECONDS
+# have passed since the last add. STREAM_POLL_SECONDS is how often the
+# script checks for new input and finished lookups.
+
+STREAM_FLUSH_SIZE = 50
+STREAM_FLUSH_SECONDS = 3
+STREAM_POLL_SECONDS = 0.2
+
+
+# Every run keeps a journal of what it has looked up and added, so an
+# interrupted run picks up where it stopped when you run it again with the
+# same file and playlist name. Journals are deleted once a playlist is
+# complete. Set to None to turn this off.
+
+JOURNAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ppg_journals')
+
+
+# Upper bounds, in seconds, of the latency histogram buckets that
+# --profile and --metrics report for each stage and HTTP endpoint.
+
+METRICS_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+# Tokens for accounts other than the admin are remembered in this file for
+# USER_TOKEN_TTL seconds, so most runs don't need to log in to plex.tv at
+# all. Set USER_TOKEN_CACHE_FILE to None to log in every time.
+
+USER_TOKEN_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ppg_user_tokens.json')
+USER_TOKEN_TTL = 7 * 24 * 60 * 60
+
+
+# When one playlist goes to several accounts, this many of them are
+# created at the same time.
+
+PUBLISH_WORKERS = 4
+
+
+# With --sync, an existing playlist is updated to match the list instead of
+# being rebuilt: missing tracks are added and extra ones removed. Set this
+# to False to also skip putting the tracks back in list order, which costs
+# one request per track that has to move.
+
+SYNC_REORDER = True
+
+
+# --serve keeps the script running as a local service that
+# plex-playlist-client.py sends playlists to. It only listens on this
+# machine. The library is checked for changes every DAEMON_REFRESH_SECONDS,
+# and the last DAEMON_JOBS_KEPT finished jobs can still be looked up.
 
-BATCH_SIZE = 20
+DAEMON_HOST = '127.0.0.1'
+DAEMON_PORT = 32499
+DAEMON_REFRESH_SECONDS = 300
+DAEMON_JOBS_KEPT = 100
 
 
-# Enter an artist and track which exists in your library.
-# This is used as a placeholder to create a playlist,
-# in the use case where only Tidal tracks are found.
-# After creating the playlist, adding the placeholder,
-# and adding Tidal tracks, the placeholder is deleted.
+# The service only takes requests that carry the secret in this file, which
+# it creates the first time it starts (readable only by you). The client
+# reads it from here too.
 
-PLACEHOLDER_ARTIST = 'LCD Soundsystem'
-PLACEHOLDER_TITLE = 'Dance Yrself Clean'
+DAEMON_SECRET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ppg_daemon_secret')
 
 
+# Songs that are hard to find on Tidal are searched several ways at once
+# (without the "(Remastered)" part, with "and" / "&" swapped, without
+# "feat. ...", without accents), and the first way that finds it wins.
+# This is how many of those searches can run at the same time overall.
 
+SEARCH_VARIANT_WORKERS = 16